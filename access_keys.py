@@ -0,0 +1,176 @@
+"""Filtro de claves de acceso para las rutas públicas.
+
+Un filtro de Bloom con todas las claves válidas permite descartar sin consultar la
+base de datos las claves que seguro no existen. Junto a él hay una caché negativa
+acotada (claves que pasaron el filtro pero no están en la base de datos) y un
+límite de fallos por IP.
+
+El filtro se construye al arrancar y se actualiza con cada ``Prompt`` insertado en
+este proceso. Las claves creadas en otros procesos se incorporan cuando el filtro
+rechaza una clave: como mucho una vez por ``refresh_interval`` se comprueba el id
+máximo de ``prompts`` y se cargan solo las filas nuevas.
+"""
+import collections
+import hashlib
+import logging
+import math
+import threading
+import time
+
+from sqlalchemy import event
+from models import db, Prompt
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CAPACITY = 10000
+DEFAULT_FALSE_POSITIVE_RATE = 0.001
+NEGATIVE_CACHE_SIZE = 10000
+NEGATIVE_CACHE_TTL_SECONDS = 300
+FAILURE_WINDOW_SECONDS = 60
+MAX_FAILURES_PER_WINDOW = 30
+MAX_TRACKED_IPS = 10000
+REFRESH_INTERVAL_SECONDS = 1.0
+
+
+class BloomFilter:
+    """Filtro de Bloom sobre un ``bytearray`` con doble hashing a partir de BLAKE2b."""
+
+    def __init__(self, capacity, false_positive_rate=DEFAULT_FALSE_POSITIVE_RATE):
+        self.capacity = max(1, capacity)
+        self.size = max(8, int(-self.capacity * math.log(false_positive_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class AccessKeyGuard:
+    """Decide si una clave merece una consulta a la base de datos."""
+
+    def __init__(self, refresh_interval=REFRESH_INTERVAL_SECONDS, max_failures=MAX_FAILURES_PER_WINDOW):
+        self.refresh_interval = refresh_interval
+        self.max_failures = max_failures
+        # Sin la IP real del cliente (detrás de un proxy sin configurar) no se limita
+        self.throttle = True
+        self.bloom = None
+        self.max_prompt_id = 0
+        self._last_refresh = 0.0
+        self._negative = collections.OrderedDict()
+        self._failures = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self.bloom is not None
+
+    def rebuild(self):
+        """Carga todas las claves de la base de datos en un filtro nuevo."""
+        total = db.session.execute(db.select(db.func.count(Prompt.id))).scalar() or 0
+        bloom = BloomFilter(max(DEFAULT_CAPACITY, total * 2))
+        max_id = 0
+        rows = db.session.execute(db.select(Prompt.id, Prompt.access_key).execution_options(yield_per=1000))
+        for prompt_id, access_key in rows:
+            bloom.add(access_key)
+            max_id = max(max_id, prompt_id)
+        with self._lock:
+            self.bloom = bloom
+            self.max_prompt_id = max_id
+            self._negative.clear()
+        logger.info(f"Filtro de claves construido con {bloom.count} claves")
+
+    def add(self, access_key, prompt_id=None):
+        if not self.ready:
+            return
+        with self._lock:
+            self.bloom.add(access_key)
+            self._negative.pop(access_key, None)
+            if prompt_id:
+                self.max_prompt_id = max(self.max_prompt_id, prompt_id)
+
+    def _refresh(self):
+        """Incorpora las claves creadas en otros procesos desde la última comprobación."""
+        now = time.monotonic()
+        if now - self._last_refresh < self.refresh_interval:
+            return
+        self._last_refresh = now
+        max_id = db.session.execute(db.select(db.func.max(Prompt.id))).scalar() or 0
+        if max_id <= self.max_prompt_id:
+            return
+        new_rows = db.session.execute(
+            db.select(Prompt.id, Prompt.access_key).where(Prompt.id > self.max_prompt_id)
+        ).all()
+        for prompt_id, access_key in new_rows:
+            self.add(access_key, prompt_id)
+        if self.bloom.count > self.bloom.capacity:
+            self.rebuild()
+
+    def might_exist(self, access_key):
+        """False si la clave seguro no existe; True si hay que consultar la base de datos."""
+        if not self.ready:
+            return True
+        if access_key not in self.bloom:
+            self._refresh()
+            if access_key not in self.bloom:
+                return False
+        with self._lock:
+            cached_at = self._negative.get(access_key)
+            if cached_at is not None and time.monotonic() - cached_at < NEGATIVE_CACHE_TTL_SECONDS:
+                return False
+        return True
+
+    def record_failure(self, access_key, ip, confirmed=False):
+        """Registra un intento con clave inválida; ``confirmed`` si lo dijo la base de datos."""
+        now = time.monotonic()
+        with self._lock:
+            if confirmed:
+                self._negative[access_key] = now
+                self._negative.move_to_end(access_key)
+                while len(self._negative) > NEGATIVE_CACHE_SIZE:
+                    self._negative.popitem(last=False)
+            window_start, failures = self._failures.get(ip, (now, 0))
+            if now - window_start > FAILURE_WINDOW_SECONDS:
+                window_start, failures = now, 0
+            self._failures[ip] = (window_start, failures + 1)
+            self._failures.move_to_end(ip)
+            while len(self._failures) > MAX_TRACKED_IPS:
+                self._failures.popitem(last=False)
+
+    def is_throttled(self, ip):
+        if not self.throttle:
+            return False
+        with self._lock:
+            window_start, failures = self._failures.get(ip, (0.0, 0))
+        return failures >= self.max_failures and time.monotonic() - window_start <= FAILURE_WINDOW_SECONDS
+
+
+access_guard = AccessKeyGuard()
+
+
+@event.listens_for(Prompt, 'after_insert')
+def _add_new_prompt_key(mapper, connection, target):
+    access_guard.add(target.access_key, target.id)
+
+
+def init_access_guard(app):
+    """Construye el filtro al arrancar; si falla, todas las claves se consultan en la BD."""
+    access_guard.max_failures = app.config.get('ACCESS_KEY_MAX_FAILURES', MAX_FAILURES_PER_WINDOW)
+    access_guard.throttle = app.config.get('ACCESS_KEY_THROTTLE', True)
+    with app.app_context():
+        try:
+            access_guard.rebuild()
+        except Exception as e:
+            logger.error(f"No se pudo construir el filtro de claves: {e}")
+    return access_guard
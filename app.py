@@ -3,13 +3,32 @@ import secrets
 import string
 import re
 import datetime
+import json
 import logging
-from flask import Flask, render_template, request, redirect, url_for, jsonify, session, flash
+import click
+from flask import Flask, render_template, request, redirect, url_for, jsonify, session, flash, Response, abort, make_response, send_file
+from werkzeug.exceptions import HTTPException
+from werkzeug.middleware.proxy_fix import ProxyFix
 from dotenv import load_dotenv
 from openai import OpenAI
 from sendgrid import SendGridAPIClient
 from sendgrid.helpers.mail import Mail
-from models import db, Prompt, ExerciseHistory, PredefinedExercise
+from models import db, Prompt, ExerciseHistory, ExerciseHistoryArchive, PredefinedExercise, ReportJob
+from search import init_search, rebuild_search_index, search_history
+from migrations import init_migrations, create_missing_indexes
+from profiling import init_profiling
+from logging_config import init_logging
+from access_keys import init_access_guard
+from prompt_templates import get_or_create_template, build_context, deduplicate_prompts
+from warmup import warmup_state, start_warm_up
+from traffic import init_traffic_capture
+from http_cache import init_http_cache, cached_response, make_etag
+from query_budget import init_query_budget
+from model_routing import ModelRouter, call_stats
+import database
+from reports import init_reports, start_report_workers, parse_report_request, job_to_dict, run_report_job
+from retention import DEFAULT_RETENTION_POLICIES, compact_history, load_history
+from structured import TUTOR_RESPONSE_SCHEMA, RESPONSE_FORMAT_INSTRUCTIONS, parse_tutor_response, format_plain_text, backfill_structured_fields
 
 # Cargar variables de entorno desde .env
 load_dotenv()
@@ -46,22 +65,20 @@ def send_access_key_email(student_email, access_key):
 
 app = Flask(__name__)
 
+# Detrás de un proxy (Render), confiar en X-Forwarded-For para conocer la IP del cliente.
+# Render define RENDER=true y pone un proxy delante, así que allí se confía en uno por defecto
+trusted_proxies = int(os.getenv('TRUSTED_PROXIES', '1' if os.getenv('RENDER') else '0'))
+if trusted_proxies:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=trusted_proxies)
+
 # --- Configuración --- #
 
 # Configurar una clave secreta para la sesión
 app.secret_key = os.getenv('FLASK_SECRET_KEY', os.urandom(24))
 
 # 🚨 IMPORTANTE: Usa el dialecto 'postgresql+psycopg' para psycopg3
-database_url = os.getenv('DATABASE_URL')
-if not database_url:
-    # Fallback a SQLite para desarrollo local
-    database_url = 'sqlite:///tutor_ia.db'
-else:
-    # Asegura que la URL use el nuevo dialecto para psycopg3
-    if database_url.startswith('postgresql://'):
-        database_url = database_url.replace('postgresql://', 'postgresql+psycopg://', 1)
-    elif database_url.startswith('postgres://'):
-        database_url = database_url.replace('postgres://', 'postgresql+psycopg://', 1)
+# Fallback a SQLite para desarrollo local
+database_url = database.normalize_database_url(os.getenv('DATABASE_URL') or 'sqlite:///tutor_ia.db')
 
 app.config['SQLALCHEMY_DATABASE_URI'] = database_url
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
@@ -69,20 +86,96 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 # Contraseña de administrador
 ADMIN_PASSWORD = os.getenv('ADMIN_PASSWORD')
 
+# Políticas de retención del historial (JSON en RETENTION_POLICIES, ver retention.py)
+retention_policies = os.getenv('RETENTION_POLICIES')
+app.config['RETENTION_POLICIES'] = json.loads(retention_policies) if retention_policies else DEFAULT_RETENTION_POLICIES
+
+# Perfilado de peticiones: fracción muestreada y token para la cabecera X-Profile
+app.config['PROFILE_SAMPLE_RATE'] = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+app.config['PROFILE_TOKEN'] = os.getenv('PROFILE_TOKEN')
+
+# Logging: nivel global, niveles por logger ("sqlalchemy.engine=INFO,app=DEBUG"),
+# formato ('json' o 'text'), longitud máxima de los campos y muestreo de DEBUG
+app.config['LOG_LEVEL'] = os.getenv('LOG_LEVEL', 'INFO').upper()
+app.config['LOG_LEVELS'] = os.getenv('LOG_LEVELS', '')
+app.config['LOG_FORMAT'] = os.getenv('LOG_FORMAT', 'json')
+app.config['LOG_MAX_FIELD_LENGTH'] = int(os.getenv('LOG_MAX_FIELD_LENGTH', '500'))
+app.config['LOG_DEBUG_SAMPLE_RATE'] = float(os.getenv('LOG_DEBUG_SAMPLE_RATE', '1'))
+
+# Intentos con clave inválida permitidos por IP y minuto antes de responder 429
+# Sin proxy de confianza configurado todas las peticiones podrían llegar con la IP del
+# proxy y el límite bloquearía a todos los alumnos, así que solo se activa con proxy
+# (o con ACCESS_KEY_THROTTLE=1 si la aplicación recibe las conexiones directamente)
+app.config['ACCESS_KEY_MAX_FAILURES'] = int(os.getenv('ACCESS_KEY_MAX_FAILURES', '30'))
+app.config['ACCESS_KEY_THROTTLE'] = os.getenv(
+    'ACCESS_KEY_THROTTLE', '1' if trusted_proxies else '0'
+).lower() in ('1', 'true', 'yes')
+
+# Captura de tráfico anónimo para replay.py (desactivada si no se indica fichero)
+app.config['TRAFFIC_CAPTURE_FILE'] = os.getenv('TRAFFIC_CAPTURE_FILE')
+
+# Máximo de consultas SQL por petición antes de registrar un aviso; las cabeceras
+# X-Query-Count y X-Query-Time-ms solo se envían en depuración o pruebas de carga
+app.config['QUERY_BUDGET'] = int(os.getenv('QUERY_BUDGET', '15'))
+app.config['QUERY_BUDGET_HEADERS'] = os.getenv('QUERY_BUDGET_HEADERS', '').lower() in ('1', 'true', 'yes')
+
+# Modelo, max_tokens, temperature y pesos A/B por acción (JSON, ver model_routing.py)
+model_routes = os.getenv('MODEL_ROUTES')
+app.config['MODEL_ROUTES'] = json.loads(model_routes) if model_routes else {}
+
+# Informes de progreso: carpeta de los ficheros, informes simultáneos y trabajos
+# admitidos (en cola o en curso) por proceso, ver reports.py
+app.config['REPORTS_DIR'] = os.getenv('REPORTS_DIR', os.path.join(app.instance_path, 'reports'))
+app.config['REPORT_WORKERS'] = int(os.getenv('REPORT_WORKERS', '1'))
+app.config['REPORT_MAX_PENDING'] = int(os.getenv('REPORT_MAX_PENDING', '4'))
+
 # Límite de tiempo de la sesión en minutos
 SESSION_TIME_LIMIT_MINUTES = 30
 
+# Respuesta al alumno cuando falla la llamada al modelo o la propia ruta
+AI_ERROR_MESSAGE = "Lo siento, ha ocurrido un error al procesar tu solicitud."
+
 # --- Inicialización ---
 
 # Inicializar la base de datos con la app
 db.init_app(app)
 
-# Configurar logging
-logging.basicConfig(level=logging.DEBUG)
+# Configurar logging (la escritura se hace en un hilo aparte, ver logging_config.py)
+init_logging(app)
 logger = logging.getLogger(__name__)
 
-# Instanciar el cliente de OpenAI
+# Perfilador (sin hooks si PROFILE_SAMPLE_RATE y PROFILE_TOKEN no están definidos)
+profiler = init_profiling(app)
+init_traffic_capture(app)
+
+# Compresión gzip/brotli de las respuestas grandes
+init_http_cache(app)
+
+# Recuento de consultas SQL por petición
+init_query_budget(app)
+
+# Crear las tablas que falten (prompt_templates, llm_calls...), añadir columnas
+# nuevas a las existentes y preparar el índice de búsqueda. Se hace en cada proceso,
+# también bajo gunicorn, antes de cualquier consulta a prompts
+init_migrations(app)
+init_search(app)
+
+# Consultas de las rutas más usadas con SQLAlchemy Core, sobre el mismo motor
+with app.app_context():
+    database.init_db(db.engine)
+
+# Filtro de claves de acceso válidas para las rutas públicas
+access_guard = init_access_guard(app)
+
+# Pool de hilos para los informes en segundo plano
+report_pool = init_reports(app)
+
+# Instanciar el cliente de OpenAI y el selector de modelo por acción
 client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+model_router = ModelRouter(app.config['MODEL_ROUTES'])
+
+# Versión de chat.html: cambia el ETag de /chat/<key> cuando se despliega una plantilla nueva
+CHAT_TEMPLATE_VERSION = make_etag(app.jinja_env.loader.get_source(app.jinja_env, 'chat.html')[0])
 
 # --- Funciones Auxiliares ---
 
@@ -91,27 +184,67 @@ def generate_unique_access_key(length=16):
     alphabet = string.ascii_letters + string.digits
     while True:
         access_key = ''.join(secrets.choice(alphabet) for _ in range(length))
-        if not Prompt.query.filter_by(access_key=access_key).first():
+        # Si el filtro no la conoce, la clave seguro no está en uso
+        if not access_guard.might_exist(access_key) or not Prompt.query.filter_by(access_key=access_key).first():
             return access_key
 
-def get_ai_response(system_prompt, user_message):
-    """Obtiene una respuesta del modelo de OpenAI."""
-    logger.debug(f"System Prompt: {system_prompt}\nUser Message: {user_message}")
+def lookup_prompt(access_key):
+    """Busca el prompt de una clave, descartando sin consultar la BD las claves que no existen.
+
+    Una clave válida se acepta siempre; a las IPs con demasiados intentos fallidos
+    recientes se les responde 429 en lugar de "clave inválida".
+    """
+    ip = request.remote_addr
+    if not access_guard.might_exist(access_key):
+        access_guard.record_failure(access_key, ip)
+        prompt = None
+    else:
+        prompt = database.get_prompt_record(access_key)
+        if prompt is None:
+            access_guard.record_failure(access_key, ip, confirmed=True)
+    if prompt is None and access_guard.is_throttled(ip):
+        abort(429)
+    return prompt
+
+def get_ai_response(system_prompt, user_message, context=None, action='chat'):
+    """Obtiene una respuesta estructurada (JSON) del modelo asignado a la acción.
+
+    El prompt de sistema (la plantilla compartida) va primero y sin cambios para
+    aprovechar la caché de prefijos; ``context`` lleva la parte propia del alumno.
+    """
+    # Argumentos diferidos: el texto solo se construye si DEBUG está activo
+    logger.debug("System Prompt: %s\nContext: %s\nUser Message: %s", system_prompt, context, user_message)
+    messages = [{"role": "system", "content": system_prompt + RESPONSE_FORMAT_INSTRUCTIONS}]
+    if context:
+        messages.append({"role": "system", "content": context})
+    messages.append({"role": "user", "content": user_message})
     try:
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_message}
-            ]
-        )
+        response_format = {"type": "json_schema", "json_schema": TUTOR_RESPONSE_SCHEMA}
+        variant = model_router.choose(action)
+        response = model_router.complete(client, action, messages, variant=variant, response_format=response_format)
+        if response.choices[0].finish_reason == 'length':
+            # JSON cortado por max_tokens: se repite una vez sin límite y con la misma variante
+            logger.warning(f"Respuesta cortada por max_tokens en la acción {action}, se reintenta sin límite")
+            response = model_router.complete(
+                client, action, messages, variant=variant, response_format=response_format, max_tokens=None
+            )
+            if response.choices[0].finish_reason == 'length':
+                return "Lo siento, la respuesta es demasiado larga. ¿Puedes dividir la pregunta en partes más pequeñas?"
         return response.choices[0].message.content
     except Exception as e:
         logger.error(f"Error al llamar a la API de OpenAI: {e}")
-        return "Lo siento, ha ocurrido un error al procesar tu solicitud."
+        return AI_ERROR_MESSAGE
 
 # --- Rutas ---
 
+@app.errorhandler(429)
+def too_many_requests(error):
+    message = 'Demasiados intentos con claves no válidas. Espera un minuto e inténtalo de nuevo.'
+    if request.is_json:
+        # chat.js muestra ai_response sea cual sea el estado
+        return jsonify({'ai_response': message, 'error': message}), 429
+    return message, 429
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
     error = None
@@ -120,49 +253,57 @@ def index():
         if not access_key:
             error = "Por favor, ingresa una clave de acceso."
         else:
-            prompt = Prompt.query.filter_by(access_key=access_key).first()
+            prompt = lookup_prompt(access_key)
             if prompt:
                 return redirect(url_for('chat', access_key=access_key))
             else:
                 error = "Clave de acceso no válida. Inténtalo de nuevo."
-    return render_template('index.html', error=error)
+    response = make_response(render_template('index.html', error=error))
+    if request.method == 'GET':
+        # La página de acceso es igual para todos
+        response.headers['Cache-Control'] = 'public, max-age=300'
+    return response
 
 @app.route('/chat/<access_key>')
 def chat(access_key):
-    prompt = Prompt.query.filter_by(access_key=access_key).first_or_404()
+    prompt = lookup_prompt(access_key)
+    if not prompt:
+        abort(404)
 
     # Reiniciar la sesión si ha expirado
     session_start_time = prompt.session_start_time
     if session_start_time:
         time_elapsed = datetime.datetime.utcnow() - session_start_time
         if time_elapsed.total_seconds() > (SESSION_TIME_LIMIT_MINUTES * 60):
-            prompt.session_start_time = datetime.datetime.utcnow()
-            db.session.commit()
-            # Recargar el tiempo de inicio después de actualizar
-            session_start_time = prompt.session_start_time
+            session_start_time = database.start_session(prompt.id)
     else:
         # Si no hay tiempo de inicio, establecerlo ahora
-        prompt.session_start_time = datetime.datetime.utcnow()
-        db.session.commit()
-        session_start_time = prompt.session_start_time
+        session_start_time = database.start_session(prompt.id)
 
     session_end_time = session_start_time + datetime.timedelta(minutes=SESSION_TIME_LIMIT_MINUTES)
-    remaining_seconds = max(0, (session_end_time - datetime.datetime.utcnow()).total_seconds())
-
-    # Recuperar ejercicios a través de la relación de SQLAlchemy
-    exercises_from_db = [exercise.exercise_text for exercise in prompt.predefined_exercises]
-    
-    logger.debug(f"Ejercicios recuperados para prompt_id {prompt.id}: {exercises_from_db}")
-    
-    exercises = [{'exercise': ex_text, 'solution': ''} for ex_text in exercises_from_db]
-    
-    initial_message = "¡Hola! Soy tu tutor de IA. Estoy aquí para ayudarte con tus ejercicios. Puedes seleccionar un ejercicio de la lista o escribir uno tú mismo."
-
-    return render_template('chat.html', 
-                         exercises=exercises, 
-                         remaining_seconds=remaining_seconds,
-                         access_key=access_key,
-                         initial_message=initial_message)
+    # El temporizador se calcula en el navegador a partir del fin de sesión, así la página
+    # no cambia cada segundo y puede revalidarse con ETag
+    session_end_ms = int(session_end_time.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000)
+
+    exercise_version = database.get_exercise_version(prompt.id)
+    etag = make_etag('chat', CHAT_TEMPLATE_VERSION, prompt.id, prompt.template_id, session_end_ms, *exercise_version)
+
+    def build():
+        exercises_from_db = database.get_predefined_exercises_by_prompt_id(prompt.id)
+
+        logger.debug("Ejercicios recuperados para prompt_id %s: %d", prompt.id, len(exercises_from_db))
+
+        exercises = [{'exercise': ex_text, 'solution': ''} for ex_text in exercises_from_db]
+
+        initial_message = "¡Hola! Soy tu tutor de IA. Estoy aquí para ayudarte con tus ejercicios. Puedes seleccionar un ejercicio de la lista o escribir uno tú mismo."
+
+        return render_template('chat.html', 
+                             exercises=exercises, 
+                             session_end_ms=session_end_ms,
+                             access_key=access_key,
+                             initial_message=initial_message)
+
+    return cached_response(etag, build)
 
 @app.route('/api/chat', methods=['POST'])
 def api_chat():
@@ -172,36 +313,49 @@ def api_chat():
         user_message = data['user_message']
         action = data.get('action')
 
-        prompt = Prompt.query.filter_by(access_key=access_key).first()
+        prompt = lookup_prompt(access_key)
         if not prompt:
-            return jsonify({'ai_response': 'Error: Clave de acceso no válida.'})
+            return jsonify({'ai_response': 'Error: Clave de acceso no válida.'}), 404
         
         time_elapsed = datetime.datetime.utcnow() - prompt.session_start_time
         if time_elapsed.total_seconds() > SESSION_TIME_LIMIT_MINUTES * 60:
-            return jsonify({'ai_response': 'Tu sesión ha expirado. Por favor, contacta a tu tutor para una nueva sesión.'})
+            return jsonify({'ai_response': 'Tu sesión ha expirado. Por favor, contacta a tu tutor para una nueva sesión.'}), 403
 
-        system_prompt = prompt.prompt_content
+        system_prompt = prompt.system_prompt
         if action == "get_solution":
-            ai_response = get_ai_response(system_prompt + "\n\nPor favor, proporciona la solución paso a paso para el siguiente ejercicio:", user_message)
+            context = build_context(prompt, "Por favor, proporciona la solución paso a paso para el siguiente ejercicio:")
+            ai_response = get_ai_response(system_prompt, user_message, context, action)
         elif action == "initial_message":
-            ai_response = get_ai_response(system_prompt, "Hola, por favor, preséntate y saluda al alumno. Adicionalmente, indícale que puede seleccionar uno de los ejercicios de la lista de la izquierda o escribir uno directamente en el chat. Si no hay ejercicios, indícale que puede escribir uno directamente en el chat.")
+            ai_response = get_ai_response(system_prompt, "Hola, por favor, preséntate y saluda al alumno. Adicionalmente, indícale que puede seleccionar uno de los ejercicios de la lista de la izquierda o escribir uno directamente en el chat. Si no hay ejercicios, indícale que puede escribir uno directamente en el chat.", build_context(prompt), action)
         else:
-            ai_response = get_ai_response(system_prompt, user_message)
-        
-        # Guardar en historial (lógica simplificada para el ejemplo)
+            ai_response = get_ai_response(system_prompt, user_message, build_context(prompt))
+
+        if ai_response == AI_ERROR_MESSAGE:
+            # El error ya se registró en get_ai_response; no se guarda en el historial
+            return jsonify({'ai_response': ai_response}), 502
+
+        # Analizar la respuesta una sola vez; el navegador recibe los campos ya separados
+        fields = parse_tutor_response(ai_response)
+        ai_text = format_plain_text(fields)
+
         new_history = ExerciseHistory(
             access_key=access_key,
             exercise_text=user_message, # Guardamos el mensaje del usuario como el ejercicio
-            solution_text=ai_response # Guardamos la respuesta completa de la IA
+            solution_text=ai_text, # Guardamos la respuesta completa de la IA en texto legible
+            exercise_type=fields['exercise_type'],
+            difficulty=fields['difficulty'],
+            action=action or 'chat'
         )
         db.session.add(new_history)
         db.session.commit()
-        
-        return jsonify({'ai_response': ai_response})
-    
+
+        return jsonify({'ai_response': ai_text, **fields})
+
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error en api_chat: {e}")
-        return jsonify({'ai_response': 'Lo siento, ha ocurrido un error al procesar tu solicitud.'})
+        return jsonify({'ai_response': AI_ERROR_MESSAGE}), 500
 
 # Ruta de administración
 @app.route('/admin')
@@ -231,6 +385,122 @@ def admin_logout():
     flash('Has cerrado la sesión.', 'info')
     return redirect(url_for('admin_login'))
 
+# Búsqueda en el historial de ejercicios
+@app.route('/admin/search')
+def admin_search():
+    if not session.get('logged_in'):
+        return jsonify({'error': 'No autorizado'}), 401
+
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Falta el parámetro q'}), 400
+
+    try:
+        since = request.args.get('since')
+        until = request.args.get('until')
+        since = datetime.datetime.fromisoformat(since) if since else None
+        until = datetime.datetime.fromisoformat(until) if until else None
+        page = int(request.args.get('page', 1))
+        per_page = int(request.args.get('per_page', 20))
+    except ValueError:
+        return jsonify({'error': 'Parámetros inválidos'}), 400
+
+    results, has_more = search_history(
+        query,
+        topic=request.args.get('topic'),
+        student=request.args.get('student'),
+        since=since,
+        until=until,
+        page=page,
+        per_page=per_page
+    )
+    return jsonify({'results': results, 'page': page, 'has_more': has_more})
+
+# Perfiles de peticiones recientes
+@app.route('/admin/profiles')
+def admin_profiles():
+    if not session.get('logged_in'):
+        return jsonify({'error': 'No autorizado'}), 401
+    return jsonify({'enabled': profiler.enabled, 'profiles': profiler.list_profiles()})
+
+# Pilas colapsadas para flamegraph.pl o speedscope (todas las del buffer si se omite el id)
+@app.route('/admin/profiles/flamegraph')
+@app.route('/admin/profiles/<int:profile_id>/flamegraph')
+def admin_profile_flamegraph(profile_id=None):
+    if not session.get('logged_in'):
+        return jsonify({'error': 'No autorizado'}), 401
+    stacks = profiler.collapsed_stacks(profile_id)
+    if stacks is None:
+        return jsonify({'error': 'Perfil no encontrado'}), 404
+    return Response(stacks, mimetype='text/plain')
+
+# Latencia, tokens y errores por acción y variante de modelo
+@app.route('/admin/model_stats')
+def admin_model_stats():
+    if not session.get('logged_in'):
+        return jsonify({'error': 'No autorizado'}), 401
+    try:
+        days = int(request.args.get('days', 7))
+    except ValueError:
+        return jsonify({'error': 'Parámetros inválidos'}), 400
+    since = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+    return jsonify({
+        'routes': model_router.routes,
+        'process': model_router.process_stats(),
+        'calls': call_stats(since)
+    })
+
+# Pedir un informe de progreso; se genera en segundo plano
+@app.route('/admin/reports', methods=['POST'])
+def admin_create_report():
+    if not session.get('logged_in'):
+        return jsonify({'error': 'No autorizado'}), 401
+    try:
+        kind, report_format, params = parse_report_request(request.get_json(silent=True) or request.form)
+    except ValueError:
+        return jsonify({'error': 'Parámetros inválidos'}), 400
+    job = report_pool.submit(kind, report_format, params)
+    if job is None:
+        return jsonify({'error': 'Demasiados informes en curso, inténtalo más tarde'}), 429
+    return jsonify({
+        'job': job_to_dict(job),
+        'status_url': url_for('admin_report_status', job_id=job.id)
+    }), 202
+
+# Últimos informes pedidos
+@app.route('/admin/reports')
+def admin_reports():
+    if not session.get('logged_in'):
+        return jsonify({'error': 'No autorizado'}), 401
+    jobs = ReportJob.query.order_by(ReportJob.id.desc()).limit(50).all()
+    return jsonify({'jobs': [job_to_dict(job) for job in jobs]})
+
+# Estado de un informe (el cliente consulta hasta que termina)
+@app.route('/admin/reports/<int:job_id>')
+def admin_report_status(job_id):
+    if not session.get('logged_in'):
+        return jsonify({'error': 'No autorizado'}), 401
+    job = db.session.get(ReportJob, job_id)
+    if job is None:
+        return jsonify({'error': 'Informe no encontrado'}), 404
+    data = job_to_dict(job)
+    if job.status == 'done':
+        data['download_url'] = url_for('admin_report_download', job_id=job.id)
+    response = jsonify(data)
+    if job.status in ('pending', 'running'):
+        response.headers['Retry-After'] = '2'
+    return response
+
+# Descargar el fichero de un informe terminado
+@app.route('/admin/reports/<int:job_id>/download')
+def admin_report_download(job_id):
+    if not session.get('logged_in'):
+        return jsonify({'error': 'No autorizado'}), 401
+    job = db.session.get(ReportJob, job_id)
+    if job is None or job.status != 'done' or not os.path.exists(job.file_path):
+        return jsonify({'error': 'Informe no disponible'}), 404
+    return send_file(job.file_path, as_attachment=True, download_name=f"informe-{job.kind}-{job.id}.{job.format}")
+
 # Crear prompt desde el admin
 @app.route('/admin/create_prompt', methods=['GET', 'POST'])
 def admin_create_prompt():
@@ -248,33 +518,32 @@ def admin_create_prompt():
         else:
             try:
                 access_key = generate_unique_access_key()
+                # El texto del prompt se comparte entre los alumnos que usan el mismo
                 new_prompt = Prompt(
                     student_email=student_email,
                     topic=topic,
-                    prompt_content=prompt_content,
+                    prompt_content='',
+                    template=get_or_create_template(prompt_content),
+                    variables=json.dumps({'topic': topic}, ensure_ascii=False),
                     access_key=access_key,
                     session_start_time=datetime.datetime.utcnow()
                 )
-                db.session.add(new_prompt)
-                db.session.commit()
-
-                # Enviar el correo electrónico con la clave de acceso
-                send_access_key_email(student_email, access_key)
-
                 exercise_lines = exercises_text.split('\n') if exercises_text else []
                 added_exercises = 0
                 for i, line in enumerate(exercise_lines):
                     if line.strip():
-                        new_exercise = PredefinedExercise(
-                            prompt_id=new_prompt.id,
+                        # A través de la relación: se insertan en el mismo commit que el prompt
+                        new_prompt.predefined_exercises.append(PredefinedExercise(
                             exercise_text=line.strip(),
                             order_in_list=i + 1
-                        )
-                        db.session.add(new_exercise)
+                        ))
                         added_exercises += 1
-                
-                if added_exercises > 0:
-                    db.session.commit()
+
+                db.session.add(new_prompt)
+                db.session.commit()
+
+                # Enviar el correo electrónico con la clave de acceso
+                send_access_key_email(student_email, access_key)
 
                 success_message = f"Prompt creado para {student_email}. Se ha enviado un correo con la clave de acceso: {access_key}"
                 if added_exercises > 0:
@@ -300,20 +569,15 @@ def generate_exercise():
     if not access_key or not prompt_id:
         return jsonify({'error': 'Faltan datos'}), 400
 
-    prompt = Prompt.query.filter_by(access_key=access_key, id=prompt_id).first()
-    if not prompt:
+    prompt = lookup_prompt(access_key)
+    if not prompt or str(prompt.id) != str(prompt_id):
         return jsonify({'error': 'Clave de acceso inválida'}), 404
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "Eres un tutor de programación experto. Genera un ejercicio práctico breve y claro basado en el tema proporcionado."}, 
-                {"role": "user", "content": f"Genera un ejercicio de programación sobre: {prompt.topic}. No expliques, solo da el ejercicio."}
-            ],
-            temperature=0.7,
-            max_tokens=200
-        )
+        response = model_router.complete(client, 'generate_exercise', [
+            {"role": "system", "content": "Eres un tutor de programación experto. Genera un ejercicio práctico breve y claro basado en el tema proporcionado."},
+            {"role": "user", "content": f"Genera un ejercicio de programación sobre: {prompt.topic}. No expliques, solo da el ejercicio."}
+        ])
         exercise_text = response.choices[0].message.content.strip()
 
         # Guardar ejercicio en base de datos
@@ -333,6 +597,7 @@ def generate_exercise():
 
     except Exception as e:
         logger.error(f"Error generando ejercicio: {e}")
+        db.session.rollback()
         return jsonify({'error': 'Error al generar ejercicio'}), 500
 
 # Endpoint para guardar solución del estudiante
@@ -350,31 +615,44 @@ def submit_solution():
     history = ExerciseHistory(
         access_key=access_key,
         exercise_text=exercise_text,
-        solution_text=solution_text
+        solution_text=solution_text,
+        action='submit_solution'
     )
     db.session.add(history)
     db.session.commit()
 
     return jsonify({'success': True})
 
+# Liveness: el proceso responde
+@app.route('/healthz')
+def healthz():
+    return jsonify({'status': 'ok'})
+
+# Readiness: el calentamiento terminó (ver warmup.py y gunicorn.conf.py)
+@app.route('/readyz')
+def readyz():
+    status = 200 if warmup_state['ready'] else 503
+    return jsonify(warmup_state), status
+
 # Verificar acceso por clave
 @app.route('/check_access/<key>')
 def check_access(key):
-    prompt = Prompt.query.filter_by(access_key=key).first()
+    prompt = lookup_prompt(key)
     if prompt:
-        return jsonify({
+        data = {
             'exists': True,
             'student_email': prompt.student_email,
             'topic': prompt.topic,
             'session_start_time': prompt.session_start_time.isoformat() if prompt.session_start_time else None
-        })
+        }
+        return cached_response(make_etag('check_access', *data.values()), lambda: jsonify(data))
     else:
         return jsonify({'exists': False}), 404
 
 # Ruta pública para resolver ejercicio
 @app.route('/solve/<key>')
 def solve(key):
-    prompt = Prompt.query.filter_by(access_key=key).first()
+    prompt = lookup_prompt(key)
     if not prompt:
         return "Clave inválida", 404
 
@@ -387,13 +665,76 @@ def solve(key):
 # Ruta para ver historial de soluciones
 @app.route('/history/<key>')
 def history(key):
-    exercises = ExerciseHistory.query.filter_by(access_key=key).all()
-    return render_template('history.html', key=key, exercises=exercises)
+    if not lookup_prompt(key):
+        abort(404)
+    # La versión del historial cambia solo al añadir o archivar filas
+    live_version = db.session.execute(
+        db.select(db.func.count(ExerciseHistory.id), db.func.max(ExerciseHistory.id))
+        .where(ExerciseHistory.access_key == key)
+    ).one()
+    archive_version = db.session.execute(
+        db.select(db.func.count(ExerciseHistoryArchive.id), db.func.max(ExerciseHistoryArchive.id))
+        .where(ExerciseHistoryArchive.access_key == key)
+    ).one()
+    etag = make_etag('history', key, *live_version, *archive_version)
+    return cached_response(etag, lambda: render_template('history.html', key=key, exercises=load_history(key)))
+
+# Crear los índices nuevos de tablas existentes sin bloquearlas: flask --app app create-indexes
+@app.cli.command('create-indexes')
+def create_indexes_command():
+    created = create_missing_indexes()
+    print(f"Índices creados: {', '.join(created) if created else 'ninguno'}")
+
+# Reconstruir el índice de búsqueda: flask --app app search-reindex
+@app.cli.command('search-reindex')
+def search_reindex_command():
+    indexed = rebuild_search_index()
+    print(f"Filas indexadas: {indexed}")
+
+# Aplicar las políticas de retención: flask --app app compact-history
+@app.cli.command('compact-history')
+def compact_history_command():
+    processed = compact_history(app.config['RETENTION_POLICIES'])
+    print(f"Filas procesadas: {processed}")
+
+# Rellenar tipo de ejercicio en el historial antiguo: flask --app app backfill-structured
+@app.cli.command('backfill-structured')
+@click.option('--start-id', default=0, help='Último id procesado en una ejecución anterior.')
+def backfill_structured_command(start_id):
+    updated = backfill_structured_fields(start_id=start_id)
+    print(f"Filas actualizadas: {updated}")
+
+# Mover el texto de los prompts antiguos a plantillas compartidas: flask --app app dedupe-prompts
+@app.cli.command('dedupe-prompts')
+def dedupe_prompts_command():
+    migrated = deduplicate_prompts()
+    print(f"Prompts migrados: {migrated}")
+
+# Generar un informe sin pasar por el pool: flask --app app report --kind course --format html
+@app.cli.command('report')
+@click.option('--kind', type=click.Choice(['student', 'course']), default='student')
+@click.option('--format', 'report_format', type=click.Choice(['csv', 'html']), default='csv')
+@click.option('--topic', default=None, help='Solo los alumnos de este tema.')
+@click.option('--since', default=None, help='Fecha ISO de inicio del periodo.')
+@click.option('--until', default=None, help='Fecha ISO de fin del periodo.')
+def report_command(kind, report_format, topic, since, until):
+    kind, report_format, params = parse_report_request(
+        {'kind': kind, 'format': report_format, 'topic': topic, 'since': since, 'until': until}
+    )
+    job = ReportJob(kind=kind, format=report_format, params=json.dumps(params, ensure_ascii=False))
+    db.session.add(job)
+    db.session.commit()
+    job = run_report_job(job.id, app.config['REPORTS_DIR'], pause_seconds=0)
+    if job.status == 'done':
+        print(f"Informe generado ({job.rows} filas): {job.file_path}")
+    else:
+        print(f"Error al generar el informe: {job.error}")
 
 # Si se ejecuta directamente (modo desarrollo)
+# Las tablas, columnas e índice de búsqueda ya se prepararon al importar el módulo
 if __name__ == '__main__':
-    with app.app_context():
-        db.create_all()  # Crea las tablas si no existen
+    start_warm_up(app, client)
+    start_report_workers(app, report_pool)
     app.run(debug=True, port=8000)
 
 # Force git to detect changes
\ No newline at end of file
@@ -0,0 +1,70 @@
+"""Compara la búsqueda de un prompt por clave con el ORM y con database.py.
+
+Uso:
+    DATABASE_URL=sqlite:////tmp/bench.db python bench_database.py --calls 5000
+
+Mide el tiempo medio por llamada (timeit, mejor de --repeat rondas) y la memoria
+asignada por llamada (tracemalloc) de cada camino, contra la misma base de datos
+y el mismo prompt de pruebas. Cada llamada del ORM usa una sesión limpia, como
+ocurre en una petición real. Usa una base de datos de pruebas: crea un prompt en ella.
+"""
+import argparse
+import os
+import timeit
+import tracemalloc
+
+BENCH_ACCESS_KEY = 'dbbench000000001'
+
+
+def ensure_bench_prompt():
+    import database
+    if database.get_prompt_record(BENCH_ACCESS_KEY) is None:
+        prompt_id = database.add_prompt('bench@example.com', 'Benchmark', 'Eres un tutor de pruebas.', BENCH_ACCESS_KEY)
+        for position in range(1, 6):
+            database.add_predefined_exercise(prompt_id, f'Ejercicio de prueba {position}', position)
+
+
+def measure(name, call, calls, repeat):
+    call()  # Calentar cachés de compilación y el pool de conexiones
+    seconds = min(timeit.repeat(call, number=calls, repeat=repeat)) / calls
+    tracemalloc.start()
+    for _ in range(calls):
+        call()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<28} {seconds * 1e6:>10.1f} µs/llamada {peak / 1024:>10.1f} KiB pico {current / calls:>10.1f} B retenidos/llamada")
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=2000, help='Llamadas por ronda')
+    parser.add_argument('--repeat', type=int, default=5, help='Rondas de timeit')
+    args = parser.parse_args()
+
+    os.environ.setdefault('OPENAI_API_KEY', 'bench')
+    import app as tutor_app
+    import database
+    from models import db, Prompt
+
+    with tutor_app.app.app_context():
+        ensure_bench_prompt()
+
+        def orm_lookup():
+            prompt = Prompt.query.filter_by(access_key=BENCH_ACCESS_KEY).first()
+            result = prompt.system_prompt, [exercise.exercise_text for exercise in prompt.predefined_exercises]
+            db.session.remove()
+            return result
+
+        def core_lookup():
+            prompt = database.get_prompt_record(BENCH_ACCESS_KEY)
+            return prompt.system_prompt, database.get_predefined_exercises_by_prompt_id(prompt.id)
+
+        print(f"{'camino':<28} {'tiempo':>21} {'memoria':>19}")
+        orm_seconds = measure('ORM (Prompt.query)', orm_lookup, args.calls, args.repeat)
+        core_seconds = measure('Core (database.py)', core_lookup, args.calls, args.repeat)
+        print(f"Core es {orm_seconds / core_seconds:.2f}x más rápido por llamada")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+"""Acceso a datos de las rutas más usadas con SQLAlchemy Core.
+
+Las consultas se definen una sola vez a nivel de módulo con parámetros enlazados,
+así SQLAlchemy reutiliza su compilación en caché (y psycopg las prepara en el
+servidor tras unas cuantas ejecuciones). Devuelven tuplas con nombre en lugar de
+objetos del ORM, sin identity map ni seguimiento de cambios.
+
+Mantiene además las funciones que importaban las versiones anteriores de la
+aplicación (app_seg.py, app_seg2.py y app_seg3.py).
+"""
+import datetime
+import json
+import os
+from typing import NamedTuple, Optional
+
+from sqlalchemy import bindparam, create_engine, func, insert, select, update
+from models import db, Prompt, PromptTemplate, ExerciseHistory, PredefinedExercise
+from access_keys import access_guard
+from prompt_templates import content_hash
+from search import index_new_history
+
+_engine = None
+
+_prompts = Prompt.__table__
+_templates = PromptTemplate.__table__
+_history = ExerciseHistory.__table__
+_exercises = PredefinedExercise.__table__
+
+
+class PromptRecord(NamedTuple):
+    id: int
+    access_key: str
+    student_email: str
+    topic: str
+    system_prompt: str
+    template_id: Optional[int]
+    variables: Optional[str]
+    session_start_time: Optional[datetime.datetime]
+
+
+# --- Consultas preparadas ---
+
+_select_prompt = (
+    select(
+        _prompts.c.id,
+        _prompts.c.access_key,
+        _prompts.c.student_email,
+        _prompts.c.topic,
+        func.coalesce(_templates.c.content, _prompts.c.prompt_content).label('system_prompt'),
+        _prompts.c.template_id,
+        _prompts.c.variables,
+        _prompts.c.session_start_time,
+    )
+    .select_from(_prompts.outerjoin(_templates, _templates.c.id == _prompts.c.template_id))
+    .where(_prompts.c.access_key == bindparam('access_key'))
+)
+
+_select_exercises = (
+    select(_exercises.c.exercise_text)
+    .where(_exercises.c.prompt_id == bindparam('prompt_id'))
+    .order_by(_exercises.c.order_in_list, _exercises.c.id)
+)
+
+_select_exercise_version = (
+    select(func.count(_exercises.c.id), func.max(_exercises.c.id))
+    .where(_exercises.c.prompt_id == bindparam('prompt_id'))
+)
+
+_select_template_id = select(_templates.c.id).where(_templates.c.content_hash == bindparam('content_hash'))
+
+_update_session_start = (
+    update(_prompts)
+    .where(_prompts.c.id == bindparam('prompt_id'))
+    .values(session_start_time=bindparam('session_start_time'))
+)
+
+
+def normalize_database_url(url):
+    """Usa el dialecto de psycopg3 para las URLs de PostgreSQL."""
+    if url.startswith('postgresql://'):
+        return url.replace('postgresql://', 'postgresql+psycopg://', 1)
+    if url.startswith('postgres://'):
+        return url.replace('postgres://', 'postgresql+psycopg://', 1)
+    return url
+
+
+def init_db(engine=None):
+    """Prepara el módulo. Sin ``engine`` crea uno a partir de DATABASE_URL y crea las tablas."""
+    global _engine
+    if engine is None:
+        engine = create_engine(normalize_database_url(os.getenv('DATABASE_URL') or 'sqlite:///tutor_ia.db'))
+        db.metadata.create_all(engine)
+    _engine = engine
+
+
+def get_prompt_record(access_key):
+    """Datos del prompt de una clave, o None si no existe."""
+    with _engine.connect() as connection:
+        row = connection.execute(_select_prompt, {'access_key': access_key}).first()
+    return PromptRecord(*row) if row else None
+
+
+def get_prompt_by_key(access_key):
+    """Devuelve ``(prompt_id, system_prompt, session_start_time)`` o None."""
+    record = get_prompt_record(access_key)
+    if record is None:
+        return None
+    return record.id, record.system_prompt, record.session_start_time
+
+
+def get_predefined_exercises_by_prompt_id(prompt_id):
+    """Textos de los ejercicios predefinidos de un prompt, en su orden."""
+    with _engine.connect() as connection:
+        return connection.execute(_select_exercises, {'prompt_id': prompt_id}).scalars().all()
+
+
+def get_exercise_version(prompt_id):
+    """``(número, id máximo)`` de los ejercicios de un prompt, para validar cachés."""
+    with _engine.connect() as connection:
+        return tuple(connection.execute(_select_exercise_version, {'prompt_id': prompt_id}).one())
+
+
+def start_session(prompt_id, now=None):
+    """Reinicia el tiempo de sesión de un prompt y devuelve el nuevo inicio."""
+    now = now or datetime.datetime.utcnow()
+    with _engine.begin() as connection:
+        connection.execute(_update_session_start, {'prompt_id': prompt_id, 'session_start_time': now})
+    return now
+
+
+def add_prompt(student_email, topic, prompt_content, access_key):
+    """Crea un prompt (con su plantilla compartida) y devuelve su id."""
+    digest = content_hash(prompt_content)
+    with _engine.begin() as connection:
+        template_id = connection.execute(_select_template_id, {'content_hash': digest}).scalar()
+        if template_id is None:
+            template_id = connection.execute(
+                insert(_templates).values(content_hash=digest, content=prompt_content, created_at=datetime.datetime.utcnow())
+            ).inserted_primary_key[0]
+        now = datetime.datetime.utcnow()
+        prompt_id = connection.execute(insert(_prompts).values(
+            student_email=student_email,
+            topic=topic,
+            prompt_content='',
+            template_id=template_id,
+            variables=json.dumps({'topic': topic}, ensure_ascii=False),
+            access_key=access_key,
+            session_start_time=now,
+            created_at=now,
+        )).inserted_primary_key[0]
+    access_guard.add(access_key, prompt_id)
+    return prompt_id
+
+
+def add_exercise_history(access_key, exercise_text, solution_text, exercise_type=None, difficulty=None, action=None):
+    """Guarda una entrada del historial y la añade al índice de búsqueda."""
+    with _engine.begin() as connection:
+        history_id = connection.execute(insert(_history).values(
+            access_key=access_key,
+            exercise_text=exercise_text,
+            solution_text=solution_text,
+            exercise_type=exercise_type,
+            difficulty=difficulty,
+            action=action,
+            timestamp=datetime.datetime.utcnow(),
+        )).inserted_primary_key[0]
+        index_new_history(connection, history_id, exercise_text, solution_text)
+    return history_id
+
+
+def add_predefined_exercise(prompt_id, exercise_text, order_in_list):
+    with _engine.begin() as connection:
+        return connection.execute(insert(_exercises).values(
+            prompt_id=prompt_id,
+            exercise_text=exercise_text,
+            order_in_list=order_in_list,
+        )).inserted_primary_key[0]
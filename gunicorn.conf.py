@@ -0,0 +1,10 @@
+# Configuración de gunicorn: se carga automáticamente desde el directorio de trabajo
+
+
+def post_worker_init(worker):
+    """Calienta cada worker (BD, plantillas, OpenAI) y reanuda los informes pendientes."""
+    from app import app, client, report_pool
+    from reports import start_report_workers
+    from warmup import warm_up
+    warm_up(app, client)
+    start_report_workers(app, report_pool)
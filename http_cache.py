@@ -0,0 +1,77 @@
+"""Caché HTTP y compresión de respuestas.
+
+``cached_response`` calcula un ETag a partir de las versiones de los datos (antes
+de renderizar nada) y responde 304 si el navegador ya tiene esa versión. Las
+respuestas HTML, JSON y de texto que superan ``COMPRESS_MIN_SIZE`` se comprimen
+con brotli (si el paquete está instalado) o gzip. Los ETag son débiles porque la
+misma versión puede enviarse comprimida o sin comprimir.
+"""
+import gzip
+import hashlib
+
+from flask import make_response, request
+
+try:
+    import brotli
+except ImportError:  # brotli es opcional
+    brotli = None
+
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_LEVEL = 6
+COMPRESSIBLE_MIMETYPES = {
+    'text/html', 'text/plain', 'text/css', 'application/json', 'application/javascript', 'text/javascript',
+}
+
+PRIVATE_REVALIDATE = 'private, no-cache'
+
+
+def make_etag(*parts):
+    """ETag a partir de los valores que identifican una versión de la respuesta."""
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def cached_response(etag, build, cache_control=PRIVATE_REVALIDATE):
+    """Devuelve 304 si el cliente tiene ``etag``; si no, construye la respuesta con ``build``."""
+    if request.if_none_match.contains_weak(etag):
+        response = make_response('', 304)
+    else:
+        response = make_response(build())
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+
+def _choose_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress_response(response):
+    """Comprime la respuesta si el cliente lo admite y merece la pena."""
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+    encoding = _choose_encoding()
+    if encoding is None:
+        return response
+    if encoding == 'br':
+        compressed = brotli.compress(data, quality=COMPRESS_LEVEL)
+    else:
+        compressed = gzip.compress(data, compresslevel=COMPRESS_LEVEL)
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def init_http_cache(app):
+    app.after_request(compress_response)
@@ -0,0 +1,140 @@
+"""Configuración de logging no bloqueante y estructurada.
+
+Las peticiones solo encolan los registros (``QueueHandler``); un ``QueueListener``
+en otro hilo los formatea como JSON y los escribe en stderr. Cada registro lleva
+el id de la petición en curso, los textos largos se recortan y los mensajes DEBUG
+pueden muestrearse para no inundar la salida.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import time
+import uuid
+
+from flask import g, has_request_context, request
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+DEFAULT_MAX_FIELD_LENGTH = 500
+
+# Atributos estándar de LogRecord; el resto llega por ``extra`` y se añade al JSON
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+def truncate(value, max_length):
+    """Recorta un texto largo indicando cuántos caracteres se omitieron."""
+    if isinstance(value, str) and len(value) > max_length:
+        return f"{value[:max_length]}... [{len(value) - max_length} caracteres omitidos]"
+    return value
+
+
+class RequestContextFilter(logging.Filter):
+    """Añade el id de la petición en curso. Se ejecuta en el hilo de la petición."""
+
+    def filter(self, record):
+        record.request_id = g.get('request_id') if has_request_context() else None
+        return True
+
+
+class PayloadFilter(logging.Filter):
+    """Recorta los argumentos largos y muestrea los registros DEBUG."""
+
+    def __init__(self, max_length=DEFAULT_MAX_FIELD_LENGTH, debug_sample_rate=1.0):
+        super().__init__()
+        self.max_length = max_length
+        self.debug_sample_rate = debug_sample_rate
+
+    def filter(self, record):
+        if record.levelno <= logging.DEBUG and self.debug_sample_rate < 1.0 and random.random() >= self.debug_sample_rate:
+            return False
+        record.msg = truncate(record.msg, self.max_length)
+        if isinstance(record.args, tuple):
+            record.args = tuple(truncate(arg, self.max_length) for arg in record.args)
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por registro, con los campos de ``extra`` incluidos."""
+
+    def format(self, record):
+        entry = {
+            'ts': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        if getattr(record, 'request_id', None):
+            entry['request_id'] = record.request_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and key != 'request_id':
+                entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def _parse_levels(value):
+    """Convierte "sqlalchemy.engine=WARNING,httpx=INFO" en un diccionario."""
+    levels = {}
+    for item in (value or '').split(','):
+        if '=' in item:
+            name, level = item.split('=', 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def init_logging(app):
+    """Configura el logging de la aplicación y registra el id y la duración de cada petición.
+
+    Debe llamarse en cada proceso de trabajo (sin ``--preload`` en gunicorn), porque
+    el hilo del ``QueueListener`` no sobrevive a un fork.
+    """
+    output = logging.StreamHandler()
+    if app.config.get('LOG_FORMAT', 'json') == 'json':
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s'))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(RequestContextFilter())
+    queue_handler.addFilter(PayloadFilter(
+        max_length=app.config.get('LOG_MAX_FIELD_LENGTH', DEFAULT_MAX_FIELD_LENGTH),
+        debug_sample_rate=app.config.get('LOG_DEBUG_SAMPLE_RATE', 1.0),
+    ))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(app.config.get('LOG_LEVEL', 'INFO'))
+    # Librerías muy verbosas en DEBUG; se pueden subir o bajar con LOG_LEVELS
+    levels = {'sqlalchemy': 'WARNING', 'httpx': 'WARNING', 'httpcore': 'WARNING', 'openai': 'WARNING', 'urllib3': 'WARNING'}
+    levels.update(_parse_levels(app.config.get('LOG_LEVELS')))
+    for name, level in levels.items():
+        logging.getLogger(name).setLevel(level)
+
+    listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    access_logger = logging.getLogger('access')
+
+    @app.before_request
+    def _start_request_log():
+        g.request_id = request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def _finish_request_log(response):
+        duration_ms = round((time.perf_counter() - g.request_start) * 1000, 2)
+        response.headers[REQUEST_ID_HEADER] = g.request_id
+        access_logger.info(
+            "%s %s %s", request.method, request.path, response.status_code,
+            extra={'status': response.status_code, 'duration_ms': duration_ms}
+        )
+        return response
+
+    return listener
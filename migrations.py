@@ -0,0 +1,87 @@
+"""Migraciones ligeras del esquema.
+
+Al arrancar cada proceso se crean las tablas que falten (con sus índices) y se
+añaden a las tablas existentes las columnas que se hayan agregado después a los
+modelos (``create_all()`` no modifica tablas existentes). Las columnas nuevas deben
+ser anulables: así añadirlas solo cambia el catálogo y no reescribe la tabla.
+
+Los índices nuevos de tablas existentes no se crean al arrancar, porque en una
+tabla grande el ``CREATE INDEX`` bloquearía las escrituras mientras se construye.
+Se crean aparte con ``flask --app app create-indexes``, que en PostgreSQL usa
+``CREATE INDEX CONCURRENTLY``.
+"""
+import logging
+
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateIndex
+from models import db
+
+logger = logging.getLogger(__name__)
+
+
+def add_missing_columns():
+    """Crea las tablas que falten y añade a las existentes las columnas que falten.
+
+    Es idempotente. Avisa en el log de los índices pendientes de ``create_missing_indexes``.
+    """
+    with db.engine.begin() as connection:
+        db.metadata.create_all(connection)
+        inspector = inspect(connection)
+        for table in db.metadata.sorted_tables:
+            existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                column_type = column.type.compile(dialect=connection.dialect)
+                connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                logger.info(f"Columna añadida: {table.name}.{column.name}")
+        pending = missing_indexes(inspector)
+    if pending:
+        logger.warning(
+            f"Índices pendientes: {', '.join(index.name for index in pending)}. "
+            "Ejecuta 'flask --app app create-indexes'"
+        )
+
+
+def missing_indexes(inspector):
+    """Índices de los modelos que no existen en la base de datos."""
+    pending = []
+    for table in db.metadata.sorted_tables:
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        pending.extend(index for index in sorted(table.indexes, key=lambda index: index.name)
+                       if index.name not in existing)
+    return pending
+
+
+def create_missing_indexes():
+    """Crea los índices que falten sin bloquear las escrituras. Devuelve sus nombres.
+
+    En PostgreSQL cada índice se crea con ``CREATE INDEX CONCURRENTLY`` fuera de
+    una transacción. Si la creación se interrumpe queda un índice inválido que hay
+    que borrar con ``DROP INDEX`` antes de volver a lanzar el comando.
+    """
+    with db.engine.connect() as connection:
+        pending = missing_indexes(inspect(connection))
+    created = []
+    for index in pending:
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            concurrently = connection.dialect.name == 'postgresql'
+            if concurrently:
+                index.dialect_options['postgresql']['concurrently'] = True
+            try:
+                logger.info(f"Creando el índice {index.name}")
+                connection.execute(CreateIndex(index, if_not_exists=True))
+            finally:
+                if concurrently:
+                    index.dialect_options['postgresql']['concurrently'] = False
+        created.append(index.name)
+    return created
+
+
+def init_migrations(app):
+    """Aplica las migraciones al arrancar sin impedir el arranque si fallan."""
+    with app.app_context():
+        try:
+            add_missing_columns()
+        except Exception as e:
+            logger.error(f"No se pudieron aplicar las migraciones: {e}")
@@ -0,0 +1,135 @@
+"""Elección de modelo por acción.
+
+Cada acción (``initial_message``, ``get_solution``, ``chat``, ``generate_exercise``)
+tiene una o varias variantes con modelo, ``max_tokens`` (opcional), ``temperature`` y peso;
+con varias variantes el tráfico se reparte al azar según el peso (pruebas A/B).
+Cada llamada queda registrada en ``llm_calls`` con su latencia y tokens, y se
+acumulan estadísticas en memoria por modelo. Las variantes de acciones que piden
+respuesta con esquema JSON deben usar modelos que lo admitan (gpt-4o-mini o
+superiores) y conviene dejarlas sin ``max_tokens``: una respuesta cortada por el
+límite es JSON incompleto.
+"""
+import collections
+import logging
+import random
+import threading
+import time
+
+from sqlalchemy import insert
+from models import db, LLMCall
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL_ROUTES = {
+    'initial_message': [{'model': 'gpt-4o-mini', 'temperature': 0.7}],
+    'get_solution': [{'model': 'gpt-4o-mini', 'temperature': 0.2}],
+    'chat': [{'model': 'gpt-4o-mini', 'temperature': 0.5}],
+    'generate_exercise': [{'model': 'gpt-4o-mini', 'max_tokens': 200, 'temperature': 0.7}],
+}
+
+
+class ModelRouter:
+    def __init__(self, routes=None):
+        self.routes = dict(DEFAULT_MODEL_ROUTES)
+        self.routes.update(routes or {})
+        self.stats = collections.defaultdict(lambda: {'calls': 0, 'errors': 0, 'latency_ms': 0.0, 'tokens': 0})
+        self._lock = threading.Lock()
+
+    def choose(self, action):
+        """Variante para una acción; las acciones desconocidas usan la ruta de 'chat'."""
+        variants = self.routes.get(action) or self.routes['chat']
+        return random.choices(variants, weights=[v.get('weight', 1) for v in variants])[0]
+
+    def complete(self, client, action, messages, variant=None, **kwargs):
+        """Llama al modelo elegido para la acción y registra el resultado.
+
+        El registro en ``llm_calls`` se escribe en su propia transacción, fuera de
+        la sesión de la ruta: si falla, se anota en el log y la respuesta sigue
+        adelante. Las excepciones de la API se propagan después de registrarlas.
+        ``kwargs`` se pasan a la API y sustituyen a los valores de la variante;
+        ``max_tokens=None`` quita el límite. ``variant`` fija la variante (por ejemplo,
+        para repetir una llamada con el mismo modelo); si no se da, se elige con ``choose``.
+        """
+        variant = variant or self.choose(action)
+        params = {'max_tokens': variant.get('max_tokens'), 'temperature': variant.get('temperature')}
+        params.update(kwargs)
+        start = time.perf_counter()
+        response = None
+        try:
+            response = client.chat.completions.create(
+                model=variant['model'],
+                messages=messages,
+                **{name: value for name, value in params.items() if value is not None}
+            )
+            return response
+        finally:
+            latency_ms = round((time.perf_counter() - start) * 1000, 2)
+            usage = getattr(response, 'usage', None)
+            self._record(action, variant, latency_ms, usage, success=response is not None)
+
+    def _record(self, action, variant, latency_ms, usage, success):
+        prompt_tokens = getattr(usage, 'prompt_tokens', None)
+        completion_tokens = getattr(usage, 'completion_tokens', None)
+        with self._lock:
+            stats = self.stats[variant['model']]
+            stats['calls'] += 1
+            stats['errors'] += 0 if success else 1
+            stats['latency_ms'] += latency_ms
+            stats['tokens'] += (prompt_tokens or 0) + (completion_tokens or 0)
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(insert(LLMCall).values(
+                    action=action,
+                    model=variant['model'],
+                    variant=variant.get('name', variant['model']),
+                    latency_ms=latency_ms,
+                    prompt_tokens=prompt_tokens,
+                    completion_tokens=completion_tokens,
+                    success=success,
+                ))
+        except Exception as e:
+            logger.error(f"No se pudo registrar la llamada al modelo: {e}")
+
+    def process_stats(self):
+        """Medias por modelo desde que arrancó este proceso."""
+        with self._lock:
+            return {
+                model: {
+                    'calls': stats['calls'],
+                    'error_rate': round(stats['errors'] / stats['calls'], 4),
+                    'avg_latency_ms': round(stats['latency_ms'] / stats['calls'], 2),
+                    'avg_tokens': round(stats['tokens'] / stats['calls'], 1),
+                }
+                for model, stats in self.stats.items() if stats['calls']
+            }
+
+
+def call_stats(since):
+    """Resultados por acción y variante guardados en la base de datos desde ``since``."""
+    rows = db.session.execute(
+        db.select(
+            LLMCall.action,
+            LLMCall.variant,
+            LLMCall.model,
+            db.func.count(LLMCall.id),
+            db.func.avg(LLMCall.latency_ms),
+            db.func.max(LLMCall.latency_ms),
+            db.func.avg(LLMCall.prompt_tokens),
+            db.func.avg(LLMCall.completion_tokens),
+            db.func.sum(db.case((LLMCall.success.is_(False), 1), else_=0)),
+        )
+        .where(LLMCall.created_at >= since)
+        .group_by(LLMCall.action, LLMCall.variant, LLMCall.model)
+        .order_by(LLMCall.action, LLMCall.variant)
+    ).all()
+    return [{
+        'action': action,
+        'variant': variant,
+        'model': model,
+        'calls': calls,
+        'avg_latency_ms': round(avg_latency or 0, 2),
+        'max_latency_ms': round(max_latency or 0, 2),
+        'avg_prompt_tokens': round(avg_prompt or 0, 1),
+        'avg_completion_tokens': round(avg_completion or 0, 1),
+        'error_rate': round((errors or 0) / calls, 4),
+    } for action, variant, model, calls, avg_latency, max_latency, avg_prompt, avg_completion, errors in rows]
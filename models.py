@@ -9,12 +9,24 @@ if TYPE_CHECKING:
 
 db = SQLAlchemy()
 
+class PromptTemplate(db.Model):
+    __tablename__ = 'prompt_templates'
+    id = db.Column(db.Integer, primary_key=True)
+    # SHA-256 del contenido: el mismo texto se guarda una sola vez
+    content_hash = db.Column(db.String(64), unique=True, nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
 class Prompt(db.Model):
     __tablename__ = 'prompts'
     id = db.Column(db.Integer, primary_key=True)
     student_email = db.Column(db.String(120), nullable=False)
     topic = db.Column(db.String(120), nullable=False)
+    # Vacío cuando el texto está en prompt_templates (ver template_id)
     prompt_content = db.Column(db.Text, nullable=False)
+    template_id = db.Column(db.Integer, ForeignKey('prompt_templates.id'), nullable=True)
+    # Variables propias del alumno en JSON, se envían después de la plantilla
+    variables = db.Column(db.Text, nullable=True)
     access_key = db.Column(db.String(16), unique=True, nullable=False)
     session_start_time = db.Column(db.DateTime, default=datetime.datetime.utcnow)
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
@@ -26,20 +38,74 @@ class Prompt(db.Model):
         lazy="select"
     )
 
+    # Se carga en la misma consulta que el prompt
+    template = relationship("PromptTemplate", lazy="joined")
+
+    @property
+    def system_prompt(self):
+        """Texto del prompt de sistema, desde la plantilla compartida si la tiene."""
+        return self.template.content if self.template else self.prompt_content
+
 class ExerciseHistory(db.Model):
     __tablename__ = 'exercise_history'
     id = db.Column(db.Integer, primary_key=True)
-    access_key = db.Column(db.String(16), ForeignKey('prompts.access_key'), nullable=False)
+    access_key = db.Column(db.String(16), ForeignKey('prompts.access_key'), nullable=False, index=True)
     exercise_text = db.Column(db.Text, nullable=False)
     solution_text = db.Column(db.Text, nullable=False)
     exercise_type = db.Column(db.String(120), nullable=True)
     difficulty = db.Column(db.String(50), nullable=True)
-    timestamp = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    action = db.Column(db.String(32), nullable=True)
+    timestamp = db.Column(db.DateTime, default=datetime.datetime.utcnow, index=True)
+
+class ExerciseHistoryArchive(db.Model):
+    __tablename__ = 'exercise_history_archive'
+    # Conserva el id original de exercise_history
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    access_key = db.Column(db.String(16), nullable=False, index=True)
+    exercise_type = db.Column(db.String(120), nullable=True)
+    difficulty = db.Column(db.String(50), nullable=True)
+    action = db.Column(db.String(32), nullable=True)
+    timestamp = db.Column(db.DateTime, nullable=True)
+    # exercise_text y solution_text en JSON comprimido con zlib
+    payload = db.Column(db.LargeBinary, nullable=False)
+    archived_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+class LLMCall(db.Model):
+    __tablename__ = 'llm_calls'
+    id = db.Column(db.Integer, primary_key=True)
+    action = db.Column(db.String(32), nullable=False)
+    model = db.Column(db.String(64), nullable=False)
+    # Nombre de la variante del reparto A/B que atendió la llamada
+    variant = db.Column(db.String(64), nullable=False)
+    latency_ms = db.Column(db.Float, nullable=False)
+    prompt_tokens = db.Column(db.Integer, nullable=True)
+    completion_tokens = db.Column(db.Integer, nullable=True)
+    success = db.Column(db.Boolean, nullable=False, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, index=True)
+
+class ReportJob(db.Model):
+    __tablename__ = 'report_jobs'
+    id = db.Column(db.Integer, primary_key=True)
+    # 'student' (una fila por alumno) o 'course' (una fila por tema)
+    kind = db.Column(db.String(16), nullable=False)
+    format = db.Column(db.String(8), nullable=False)
+    # Filtros en JSON: topic, access_key, since, until
+    params = db.Column(db.Text, nullable=True)
+    # pending, running, done o failed
+    status = db.Column(db.String(16), nullable=False, default='pending', index=True)
+    rows = db.Column(db.Integer, nullable=True)
+    file_path = db.Column(db.String(255), nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, index=True)
+    started_at = db.Column(db.DateTime, nullable=True)
+    # Lo actualiza periódicamente el worker que lo ejecuta; sin latido, el trabajo se da por perdido
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
 
 class PredefinedExercise(db.Model):
     __tablename__ = 'predefined_exercises'
     id = db.Column(db.Integer, primary_key=True)
-    prompt_id = db.Column(db.Integer, ForeignKey('prompts.id'), nullable=False)
+    prompt_id = db.Column(db.Integer, ForeignKey('prompts.id'), nullable=False, index=True)
     exercise_text = db.Column(db.Text, nullable=False)
     order_in_list = db.Column(db.Integer, nullable=False)
     
@@ -0,0 +1,131 @@
+"""Perfilado de peticiones bajo demanda.
+
+Con el perfilado activado se muestrea una fracción de las peticiones (o las que
+traen la cabecera ``X-Profile`` con el token configurado): un hilo toma la pila del
+hilo de la petición cada pocos milisegundos con ``sys._current_frames()``. Los
+resultados se guardan en un buffer circular y se sirven como pilas colapsadas
+("a;b;c 12"), el formato de entrada de flamegraph.pl y speedscope.
+
+Si el perfilado está desactivado no se registra ningún hook, así que no añade
+ningún coste a las peticiones.
+"""
+import collections
+import datetime
+import hmac
+import itertools
+import random
+import sys
+import threading
+import time
+
+from flask import g, request
+
+PROFILE_HEADER = 'X-Profile'
+DEFAULT_SAMPLE_INTERVAL = 0.005
+DEFAULT_BUFFER_SIZE = 50
+
+_profile_ids = itertools.count(1)
+
+
+class RequestSampler:
+    """Muestrea periódicamente la pila de un hilo hasta que se llama a ``stop``."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+
+
+class Profiler:
+    """Decide qué peticiones perfilar y guarda los últimos resultados."""
+
+    def __init__(self, sample_rate=0.0, token=None, interval=DEFAULT_SAMPLE_INTERVAL, buffer_size=DEFAULT_BUFFER_SIZE):
+        self.sample_rate = sample_rate
+        self.token = token
+        self.interval = interval
+        self.profiles = collections.deque(maxlen=buffer_size)
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.sample_rate > 0 or bool(self.token)
+
+    def should_profile(self):
+        header = request.headers.get(PROFILE_HEADER)
+        # Comparación en tiempo constante para no filtrar el token por tiempos
+        if self.token and header and hmac.compare_digest(header.encode(), self.token.encode()):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def before_request(self):
+        if not self.should_profile():
+            return
+        g.profile_sampler = RequestSampler(threading.get_ident(), self.interval)
+        g.profile_start = time.perf_counter()
+        g.profile_sampler.start()
+
+    def teardown_request(self, exc):
+        sampler = g.pop('profile_sampler', None)
+        if sampler is None:
+            return
+        sampler.stop()
+        with self._lock:
+            self.profiles.append({
+                'id': next(_profile_ids),
+                'method': request.method,
+                'path': request.path,
+                'duration_ms': round((time.perf_counter() - g.pop('profile_start')) * 1000, 2),
+                'timestamp': datetime.datetime.utcnow().isoformat(),
+                'samples': sum(sampler.stacks.values()),
+                'stacks': sampler.stacks,
+            })
+
+    def list_profiles(self):
+        with self._lock:
+            return [{key: value for key, value in profile.items() if key != 'stacks'} for profile in self.profiles]
+
+    def collapsed_stacks(self, profile_id=None):
+        """Pilas colapsadas de un perfil, o de todos los del buffer si no se indica id."""
+        with self._lock:
+            selected = [p for p in self.profiles if profile_id is None or p['id'] == profile_id]
+        if not selected:
+            return None
+        merged = collections.Counter()
+        for profile in selected:
+            merged.update(profile['stacks'])
+        return '\n'.join(f"{stack} {count}" for stack, count in merged.most_common())
+
+
+def init_profiling(app):
+    """Crea el perfilador según la configuración y registra sus hooks si está activo."""
+    profiler = Profiler(
+        sample_rate=app.config.get('PROFILE_SAMPLE_RATE', 0.0),
+        token=app.config.get('PROFILE_TOKEN'),
+        interval=app.config.get('PROFILE_SAMPLE_INTERVAL', DEFAULT_SAMPLE_INTERVAL),
+        buffer_size=app.config.get('PROFILE_BUFFER_SIZE', DEFAULT_BUFFER_SIZE),
+    )
+    if profiler.enabled:
+        app.before_request(profiler.before_request)
+        app.teardown_request(profiler.teardown_request)
+    return profiler
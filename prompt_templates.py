@@ -0,0 +1,71 @@
+"""Plantillas de prompt compartidas.
+
+Los prompts de sistema se guardan una sola vez en ``prompt_templates``, indexados
+por el SHA-256 de su contenido, y cada ``Prompt`` solo referencia su plantilla y
+guarda aparte sus variables (tema del alumno). Al montar los mensajes para el
+modelo la plantilla va primero y sin cambios, y lo variable después, de modo que
+todas las peticiones de una clase comparten el mismo prefijo y aprovechan la caché
+de prefijos del proveedor.
+"""
+import hashlib
+import json
+import logging
+
+from sqlalchemy.exc import IntegrityError
+from models import db, Prompt, PromptTemplate
+
+logger = logging.getLogger(__name__)
+
+DEDUPLICATE_BATCH_SIZE = 200
+
+
+def content_hash(content):
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def get_or_create_template(content):
+    """Devuelve la plantilla con ese contenido, creándola si no existe (sin confirmar)."""
+    digest = content_hash(content)
+    template = PromptTemplate.query.filter_by(content_hash=digest).first()
+    if template:
+        return template
+    template = PromptTemplate(content_hash=digest, content=content)
+    try:
+        # Punto de guardado: si otro proceso la creó a la vez, se usa la suya
+        with db.session.begin_nested():
+            db.session.add(template)
+    except IntegrityError:
+        template = PromptTemplate.query.filter_by(content_hash=digest).one()
+    return template
+
+
+def build_context(prompt, instruction=None):
+    """Parte variable del prompt de sistema: datos del alumno e instrucción de la acción."""
+    variables = json.loads(prompt.variables) if prompt.variables else {'topic': prompt.topic}
+    lines = [f"Tema de la sesión: {variables['topic']}"] if variables.get('topic') else []
+    lines.extend(f"{key}: {value}" for key, value in variables.items() if key != 'topic')
+    if instruction:
+        lines.append(instruction)
+    return '\n'.join(lines)
+
+
+def deduplicate_prompts(batch_size=DEDUPLICATE_BATCH_SIZE):
+    """Mueve el contenido de los prompts antiguos a plantillas compartidas.
+
+    Cada lote se confirma por separado y solo toca prompts sin plantilla, así que
+    se puede interrumpir y volver a lanzar. Devuelve el número de prompts migrados.
+    """
+    migrated = 0
+    while True:
+        prompts = Prompt.query.filter(Prompt.template_id.is_(None)).order_by(Prompt.id).limit(batch_size).all()
+        if not prompts:
+            break
+        for prompt in prompts:
+            prompt.template = get_or_create_template(prompt.prompt_content)
+            if prompt.variables is None:
+                prompt.variables = json.dumps({'topic': prompt.topic}, ensure_ascii=False)
+            prompt.prompt_content = ''
+        db.session.commit()
+        migrated += len(prompts)
+        logger.info(f"Deduplicación de prompts: {migrated} prompts migrados")
+    return migrated
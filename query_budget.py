@@ -0,0 +1,105 @@
+"""Recuento de consultas SQL por petición.
+
+Los eventos del motor de SQLAlchemy cuentan las consultas y el tiempo en base de
+datos de cada petición. Con ``QUERY_BUDGET_HEADERS`` activo (depuración o pruebas
+de carga) se devuelven en las cabeceras ``X-Query-Count`` y ``X-Query-Time-ms``, y
+las peticiones que superan ``QUERY_BUDGET`` consultas se registran como aviso.
+
+``assert_max_queries`` sirve en pruebas para fijar el máximo de consultas de una ruta::
+
+    with assert_max_queries(3):
+        client.get('/chat/clave')
+"""
+import contextlib
+import logging
+import threading
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUERY_BUDGET = 15
+
+# Contadores abiertos con count_queries() en el hilo actual
+_local = threading.local()
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = []
+
+
+def _active_counters():
+    counters = list(getattr(_local, 'counters', ()))
+    if has_request_context() and 'query_counter' in g:
+        counters.append(g.query_counter)
+    return counters
+
+
+# El inicio se guarda en el contexto de ejecución y no en la conexión: si la
+# consulta falla no queda nada pendiente que después desajuste los tiempos
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._query_start = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._query_start
+    for counter in _active_counters():
+        counter.count += 1
+        counter.seconds += elapsed
+        counter.statements.append(statement)
+
+
+@contextlib.contextmanager
+def count_queries():
+    """Cuenta las consultas ejecutadas en el hilo actual dentro del bloque."""
+    counter = QueryCounter()
+    if not hasattr(_local, 'counters'):
+        _local.counters = []
+    _local.counters.append(counter)
+    try:
+        yield counter
+    finally:
+        _local.counters.remove(counter)
+
+
+@contextlib.contextmanager
+def assert_max_queries(limit):
+    """Falla si el bloque ejecuta más de ``limit`` consultas, mostrando cuáles fueron."""
+    with count_queries() as counter:
+        yield counter
+    assert counter.count <= limit, (
+        f"Se esperaban como mucho {limit} consultas y se ejecutaron {counter.count}:\n"
+        + '\n'.join(counter.statements)
+    )
+
+
+def init_query_budget(app):
+    budget = app.config.get('QUERY_BUDGET', DEFAULT_QUERY_BUDGET)
+    expose_headers = app.config.get('QUERY_BUDGET_HEADERS', False)
+
+    @app.before_request
+    def _start_query_count():
+        g.query_counter = QueryCounter()
+
+    @app.after_request
+    def _finish_query_count(response):
+        counter = g.pop('query_counter', None)
+        if counter is None:
+            return response
+        if expose_headers:
+            response.headers['X-Query-Count'] = str(counter.count)
+            response.headers['X-Query-Time-ms'] = f"{counter.seconds * 1000:.2f}"
+        if counter.count > budget:
+            logger.warning(
+                "Presupuesto de consultas superado: %s %s", request.method, request.path,
+                extra={'query_count': counter.count, 'query_budget': budget, 'query_time_ms': round(counter.seconds * 1000, 2)}
+            )
+        return response
@@ -0,0 +1,203 @@
+"""Reproduce una traza de tráfico contra la aplicación con el LLM simulado.
+
+Uso:
+    DATABASE_URL=sqlite:////tmp/bench.db python replay.py traza.jsonl --speed 10
+    DATABASE_URL=sqlite:////tmp/bench.db python replay.py --from-history 1000 --speed 100
+
+La traza es la que escribe la captura de traffic.py (TRAFFIC_CAPTURE_FILE), o se
+genera a partir de las filas más recientes de exercise_history con --from-history.
+Las peticiones se lanzan respetando los intervalos entre llegadas divididos por
+--speed, contra la aplicación en proceso con un cliente de OpenAI simulado que
+tarda --llm-latency segundos. Al final se muestran las latencias por ruta y la
+tasa de errores (respuestas con estado 4xx/5xx, que /api/chat devuelve al fallar).
+Usa una base de datos de pruebas: la reproducción escribe en ella.
+"""
+import argparse
+import concurrent.futures
+import datetime
+import json
+import os
+import statistics
+import threading
+import time
+from types import SimpleNamespace
+
+BENCH_ACCESS_KEY = 'replaybench00001'
+
+
+class StubLLMClient:
+    """Sustituto del cliente de OpenAI que responde tras una espera fija."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+        self.models = SimpleNamespace(list=lambda: [])
+
+    def with_options(self, **kwargs):
+        return self
+
+    def _create(self, **kwargs):
+        time.sleep(self.latency)
+        content = json.dumps({
+            'message': 'Respuesta simulada. ' * 20,
+            'exercise': None,
+            'solution': None,
+            'exercise_type': None,
+            'difficulty': None,
+        })
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content), finish_reason='stop')],
+            usage=SimpleNamespace(prompt_tokens=500, completion_tokens=100, total_tokens=600),
+        )
+
+
+def load_trace(path):
+    with open(path, encoding='utf-8') as trace_file:
+        return [json.loads(line) for line in trace_file if line.strip()]
+
+
+def trace_from_history(limit):
+    """Traza con los tiempos, acciones y tamaños del historial real.
+
+    Las soluciones enviadas se reproducen contra /submit_solution (sin LLM) y el
+    resto de filas contra /api/chat.
+    """
+    from models import db, ExerciseHistory
+    rows = db.session.execute(
+        db.select(
+            ExerciseHistory.timestamp,
+            ExerciseHistory.action,
+            db.func.length(ExerciseHistory.exercise_text),
+            db.func.length(ExerciseHistory.solution_text),
+        )
+        .order_by(ExerciseHistory.id.desc())
+        .limit(limit)
+    ).all()
+    events = []
+    for timestamp, action, exercise_length, solution_length in reversed(rows):
+        ts = timestamp.timestamp() if timestamp else 0.0
+        if action == 'submit_solution':
+            events.append({'ts': ts, 'route': '/submit_solution', 'action': None, 'message_chars': solution_length or 0})
+        else:
+            events.append({
+                'ts': ts,
+                'route': '/api/chat',
+                'action': None if action in (None, 'chat') else action,
+                'message_chars': exercise_length or 0,
+            })
+    return events
+
+
+def ensure_bench_prompt(app):
+    from models import db, Prompt, PredefinedExercise
+    with app.app_context():
+        prompt = Prompt.query.filter_by(access_key=BENCH_ACCESS_KEY).first()
+        if prompt is None:
+            prompt = Prompt(
+                student_email='replay@example.com',
+                topic='Replay',
+                prompt_content='Eres un tutor de pruebas.',
+                access_key=BENCH_ACCESS_KEY,
+            )
+            db.session.add(prompt)
+        # Sesión recién iniciada para que /api/chat no responda que ha expirado
+        prompt.session_start_time = datetime.datetime.utcnow()
+        db.session.commit()
+        if not PredefinedExercise.query.filter_by(prompt_id=prompt.id).first():
+            db.session.add(PredefinedExercise(prompt_id=prompt.id, exercise_text='Ejercicio de prueba', order_in_list=1))
+            db.session.commit()
+        return prompt.id
+
+
+def build_request(event, prompt_id):
+    """Cuerpo sintético con el tamaño registrado en la traza."""
+    text = 'x' * max(1, event.get('message_chars') or 1)
+    route = event['route']
+    if route == '/api/chat':
+        body = {'access_key': BENCH_ACCESS_KEY, 'user_message': text}
+        if event.get('action'):
+            body['action'] = event['action']
+    elif route == '/generate_exercise':
+        body = {'access_key': BENCH_ACCESS_KEY, 'prompt_id': prompt_id}
+    else:
+        body = {'access_key': BENCH_ACCESS_KEY, 'exercise_text': 'Ejercicio de prueba', 'solution_text': text}
+    return route, body
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def replay(app, events, speed, workers):
+    prompt_id = ensure_bench_prompt(app)
+    results = []
+    lock = threading.Lock()
+
+    def send(event):
+        route, body = build_request(event, prompt_id)
+        client = app.test_client()
+        start = time.perf_counter()
+        try:
+            response = client.post(route, json=body)
+            ok = response.status_code < 400 and 'error' not in (response.get_json(silent=True) or {})
+        except Exception:
+            ok = False
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with lock:
+            results.append((route, elapsed_ms, ok))
+
+    first_ts = events[0]['ts'] if events else 0.0
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        for event in events:
+            delay = (event['ts'] - first_ts) / speed - (time.perf_counter() - started)
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(send, event)
+    return results, time.perf_counter() - started
+
+
+def print_report(results, wall_seconds):
+    print(f"{'ruta':<20} {'n':>6} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9} {'errores':>8}")
+    for route in sorted({result[0] for result in results}):
+        latencies = [elapsed for r, elapsed, _ in results if r == route]
+        errors = sum(1 for r, _, ok in results if r == route and not ok)
+        print(f"{route:<20} {len(latencies):>6} {statistics.median(latencies):>8.1f}ms "
+              f"{percentile(latencies, 0.9):>8.1f}ms {percentile(latencies, 0.99):>8.1f}ms "
+              f"{max(latencies):>8.1f}ms {errors / len(latencies):>7.1%}")
+    print(f"Total: {len(results)} peticiones en {wall_seconds:.1f} s ({len(results) / wall_seconds:.1f} req/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('trace', nargs='?', help='Fichero JSONL de la captura de tráfico')
+    parser.add_argument('--from-history', type=int, metavar='N', help='Generar la traza con las últimas N filas del historial')
+    parser.add_argument('--speed', type=float, default=1.0, help='Factor de aceleración (1, 10, 100...)')
+    parser.add_argument('--llm-latency', type=float, default=1.0, help='Segundos que tarda el LLM simulado')
+    parser.add_argument('--workers', type=int, default=32, help='Peticiones simultáneas máximas')
+    args = parser.parse_args()
+    if not args.trace and not args.from_history:
+        parser.error('Indica un fichero de traza o --from-history')
+
+    os.environ.setdefault('OPENAI_API_KEY', 'replay')
+    import app as tutor_app
+    tutor_app.client = StubLLMClient(args.llm_latency)
+    # Todas las peticiones llegan desde la misma IP; el límite de fallos no aplica
+    tutor_app.access_guard.max_failures = float('inf')
+
+    if args.trace:
+        events = load_trace(args.trace)
+    else:
+        with tutor_app.app.app_context():
+            events = trace_from_history(args.from_history)
+    events = [event for event in events if event.get('route')]
+    if not events:
+        parser.error('La traza está vacía')
+
+    results, wall_seconds = replay(tutor_app.app, events, args.speed, args.workers)
+    print_report(results, wall_seconds)
+
+
+if __name__ == '__main__':
+    main()
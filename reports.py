@@ -0,0 +1,473 @@
+"""Informes de progreso generados en segundo plano.
+
+Un informe se pide como trabajo (tabla ``report_jobs``) y lo ejecuta un pool de
+hilos propio del proceso, fuera de las peticiones. El historial (filas vivas y
+archivadas) se recorre una sola vez con un cursor de servidor por lotes de
+``REPORT_STREAM_BATCH_SIZE`` filas, ordenado por alumno, de modo que cada alumno
+se agrega y se escribe en cuanto termina su historial y la memoria no depende
+del tamaño de la tabla. Los ficheros CSV o HTML se escriben en ``REPORTS_DIR``,
+compartido por los workers de la misma máquina.
+
+Para no competir con el chat, cada proceso ejecuta como mucho ``REPORT_WORKERS``
+informes a la vez (una conexión del pool cada uno), admite como mucho
+``REPORT_MAX_PENDING`` trabajos entre en cola y en curso, y cede la CPU entre
+lotes.
+"""
+import concurrent.futures
+import csv
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import func, select, union_all, update
+from models import db, Prompt, ExerciseHistory, ExerciseHistoryArchive, PredefinedExercise, ReportJob
+
+logger = logging.getLogger(__name__)
+
+REPORT_KINDS = ('student', 'course')
+REPORT_FORMATS = ('csv', 'html')
+REPORT_STREAM_BATCH_SIZE = 1000
+REPORT_BATCH_PAUSE_SECONDS = 0.01
+# Cada cuánto anota su latido el worker que ejecuta un informe, y a partir de qué
+# antigüedad del último latido se da el trabajo por interrumpido
+REPORT_HEARTBEAT_INTERVAL_SECONDS = 30
+REPORT_HEARTBEAT_TIMEOUT = datetime.timedelta(minutes=5)
+# Dos mensajes separados por más tiempo pertenecen a sesiones de trabajo distintas
+ACTIVITY_GAP = datetime.timedelta(minutes=30)
+
+STUDENT_COLUMNS = [
+    ('access_key', 'Clave'),
+    ('student_email', 'Alumno'),
+    ('topic', 'Tema'),
+    ('exercises_assigned', 'Ejercicios asignados'),
+    ('solutions_submitted', 'Soluciones enviadas'),
+    ('solutions_requested', 'Soluciones pedidas'),
+    ('messages', 'Mensajes'),
+    ('sessions', 'Sesiones'),
+    ('minutes_spent', 'Minutos'),
+    ('exercise_types', 'Tipos de ejercicio'),
+    ('first_activity', 'Primera actividad'),
+    ('last_activity', 'Última actividad'),
+]
+
+COURSE_COLUMNS = [
+    ('topic', 'Tema'),
+    ('students', 'Alumnos'),
+    ('active_students', 'Alumnos con actividad'),
+    ('exercises_assigned', 'Ejercicios asignados'),
+    ('solutions_submitted', 'Soluciones enviadas'),
+    ('solutions_requested', 'Soluciones pedidas'),
+    ('messages', 'Mensajes'),
+    ('sessions', 'Sesiones'),
+    ('minutes_spent', 'Minutos'),
+    ('avg_minutes_per_active_student', 'Minutos por alumno activo'),
+    ('last_activity', 'Última actividad'),
+]
+
+_prompts = Prompt.__table__
+_history = ExerciseHistory.__table__
+_archive = ExerciseHistoryArchive.__table__
+_exercises = PredefinedExercise.__table__
+
+
+def parse_report_request(data):
+    """Valida los datos de una petición de informe. Devuelve ``(kind, format, params)``.
+
+    Lanza ValueError si el tipo, el formato o las fechas no son válidos.
+    """
+    kind = data.get('kind') or 'student'
+    report_format = data.get('format') or 'csv'
+    if kind not in REPORT_KINDS or report_format not in REPORT_FORMATS:
+        raise ValueError(f"Tipo o formato de informe no válido: {kind}, {report_format}")
+    params = {}
+    for name in ('topic', 'access_key'):
+        value = (data.get(name) or '').strip()
+        if value:
+            params[name] = value
+    for name in ('since', 'until'):
+        if data.get(name):
+            params[name] = datetime.datetime.fromisoformat(data[name]).isoformat()
+    return kind, report_format, params
+
+
+def job_to_dict(job):
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'format': job.format,
+        'params': json.loads(job.params) if job.params else {},
+        'status': job.status,
+        'rows': job.rows,
+        'error': job.error,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+# --- Consulta y agregación ---
+
+def _progress_query(params):
+    """Una fila por evento del historial (vivo o archivado) con los datos de su alumno.
+
+    Los alumnos sin actividad aparecen una vez con las columnas del evento a NULL.
+    """
+    since = datetime.datetime.fromisoformat(params['since']) if params.get('since') else None
+    until = datetime.datetime.fromisoformat(params['until']) if params.get('until') else None
+    branches = []
+    for table in (_history, _archive):
+        branch = select(table.c.access_key, table.c.timestamp, table.c.action, table.c.exercise_type)
+        if since:
+            branch = branch.where(table.c.timestamp >= since)
+        if until:
+            branch = branch.where(table.c.timestamp < until)
+        branches.append(branch)
+    activity = union_all(*branches).subquery('activity')
+    assigned = (
+        select(_exercises.c.prompt_id, func.count(_exercises.c.id).label('assigned'))
+        .group_by(_exercises.c.prompt_id)
+        .subquery('assigned')
+    )
+    query = (
+        select(
+            _prompts.c.access_key,
+            _prompts.c.student_email,
+            _prompts.c.topic,
+            func.coalesce(assigned.c.assigned, 0),
+            activity.c.timestamp,
+            activity.c.action,
+            activity.c.exercise_type,
+        )
+        .select_from(
+            _prompts
+            .outerjoin(assigned, assigned.c.prompt_id == _prompts.c.id)
+            .outerjoin(activity, activity.c.access_key == _prompts.c.access_key)
+        )
+        .order_by(_prompts.c.access_key, activity.c.timestamp)
+    )
+    if params.get('topic'):
+        query = query.where(_prompts.c.topic == params['topic'])
+    if params.get('access_key'):
+        query = query.where(_prompts.c.access_key == params['access_key'])
+    return query
+
+
+def _stream(connection, query, batch_size, pause_seconds):
+    # yield_per activa stream_results: en PostgreSQL se usa un cursor de servidor
+    result = connection.execution_options(yield_per=batch_size).execute(query)
+    for partition in result.partitions():
+        yield from partition
+        time.sleep(pause_seconds)
+
+
+def _new_student(access_key, student_email, topic, assigned):
+    return {
+        'access_key': access_key,
+        'student_email': student_email,
+        'topic': topic,
+        'exercises_assigned': assigned,
+        'solutions_submitted': 0,
+        'solutions_requested': 0,
+        'messages': 0,
+        'sessions': 0,
+        'seconds_spent': 0.0,
+        'exercise_types': set(),
+        'first_activity': None,
+        'last_activity': None,
+    }
+
+
+def _add_event(progress, timestamp, action, exercise_type):
+    if action == 'submit_solution':
+        progress['solutions_submitted'] += 1
+    elif action == 'get_solution':
+        progress['solutions_requested'] += 1
+    elif action != 'initial_message':
+        progress['messages'] += 1
+    if exercise_type:
+        progress['exercise_types'].add(exercise_type)
+    if timestamp is None:
+        return
+    last = progress['last_activity']
+    # El tiempo dedicado es la suma de los intervalos entre eventos de una misma sesión
+    if last is None or timestamp - last > ACTIVITY_GAP:
+        progress['sessions'] += 1
+    else:
+        progress['seconds_spent'] += (timestamp - last).total_seconds()
+    if progress['first_activity'] is None:
+        progress['first_activity'] = timestamp
+    progress['last_activity'] = timestamp
+
+
+def _student_row(progress):
+    row = dict(progress)
+    row['minutes_spent'] = round(row.pop('seconds_spent') / 60, 1)
+    row['exercise_types'] = ', '.join(sorted(row['exercise_types']))
+    return row
+
+
+def student_progress(rows):
+    """Agrega las filas de ``_progress_query`` (ordenadas por clave) en una fila por alumno."""
+    progress = None
+    for access_key, student_email, topic, assigned, timestamp, action, exercise_type in rows:
+        if progress is None or progress['access_key'] != access_key:
+            if progress is not None:
+                yield _student_row(progress)
+            progress = _new_student(access_key, student_email, topic, assigned)
+        if timestamp is None and action is None:
+            continue  # Alumno sin actividad en el periodo
+        _add_event(progress, timestamp, action, exercise_type)
+    if progress is not None:
+        yield _student_row(progress)
+
+
+def course_progress(students):
+    """Agrega las filas por alumno en una fila por tema."""
+    courses = {}
+    for student in students:
+        course = courses.setdefault(student['topic'], {
+            'topic': student['topic'],
+            'students': 0,
+            'active_students': 0,
+            'exercises_assigned': 0,
+            'solutions_submitted': 0,
+            'solutions_requested': 0,
+            'messages': 0,
+            'sessions': 0,
+            'minutes_spent': 0.0,
+            'last_activity': None,
+        })
+        course['students'] += 1
+        course['active_students'] += 1 if student['last_activity'] else 0
+        for name in ('exercises_assigned', 'solutions_submitted', 'solutions_requested', 'messages', 'sessions', 'minutes_spent'):
+            course[name] += student[name]
+        if student['last_activity'] and (course['last_activity'] is None or student['last_activity'] > course['last_activity']):
+            course['last_activity'] = student['last_activity']
+    for topic in sorted(courses):
+        course = courses[topic]
+        course['minutes_spent'] = round(course['minutes_spent'], 1)
+        course['avg_minutes_per_active_student'] = (
+            round(course['minutes_spent'] / course['active_students'], 1) if course['active_students'] else 0
+        )
+        yield course
+
+
+# --- Escritura ---
+
+def _cell(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(sep=' ', timespec='seconds')
+    return '' if value is None else value
+
+
+def _write_csv(path, columns, rows, title):
+    with open(path, 'w', newline='', encoding='utf-8') as report_file:
+        writer = csv.writer(report_file)
+        writer.writerow([header for _, header in columns])
+        for row in rows:
+            writer.writerow([_cell(row[name]) for name, _ in columns])
+
+
+def _write_html(path, columns, rows, title):
+    # generate() renderiza la plantilla por partes a medida que llegan las filas
+    template = current_app.jinja_env.get_template('report.html')
+    with open(path, 'w', encoding='utf-8') as report_file:
+        for chunk in template.generate(
+            title=title,
+            columns=columns,
+            rows=([_cell(row[name]) for name, _ in columns] for row in rows),
+            generated_at=datetime.datetime.utcnow().isoformat(sep=' ', timespec='seconds'),
+        ):
+            report_file.write(chunk)
+
+
+_WRITERS = {'csv': _write_csv, 'html': _write_html}
+
+
+def _report_title(kind, params):
+    title = 'Progreso por alumno' if kind == 'student' else 'Progreso por tema'
+    filters = [f"{name}: {value}" for name, value in params.items()]
+    return f"{title} ({', '.join(filters)})" if filters else title
+
+
+def run_report_job(job_id, reports_dir, batch_size=REPORT_STREAM_BATCH_SIZE, pause_seconds=REPORT_BATCH_PAUSE_SECONDS):
+    """Genera el informe de un trabajo pendiente. Devuelve el trabajo, o None si otro lo tomó.
+
+    La sesión se cierra antes de recorrer el historial: durante el informe el worker
+    solo ocupa la conexión del cursor, sin otra transacción abierta.
+    """
+    claimed = db.session.execute(
+        update(ReportJob)
+        .where(ReportJob.id == job_id, ReportJob.status == 'pending')
+        .values(status='running', started_at=datetime.datetime.utcnow(), heartbeat_at=datetime.datetime.utcnow())
+    )
+    db.session.commit()
+    if claimed.rowcount != 1:
+        return None
+    job = db.session.get(ReportJob, job_id)
+    kind, report_format = job.kind, job.format
+    params = json.loads(job.params) if job.params else {}
+    db.session.close()
+
+    path = os.path.join(reports_dir, f"report-{job_id}.{report_format}")
+    temp_path = f"{path}.tmp"
+    written = 0
+
+    def counted(rows):
+        nonlocal written
+        for row in rows:
+            written += 1
+            yield row
+
+    # El latido va en un hilo aparte: la primera fila puede tardar minutos en llegar
+    # mientras la base de datos ordena el historial
+    stop_heartbeat = threading.Event()
+    threading.Thread(
+        target=_heartbeat, args=(db.engine, job_id, stop_heartbeat), name=f'report-heartbeat-{job_id}', daemon=True
+    ).start()
+
+    start = time.perf_counter()
+    try:
+        os.makedirs(reports_dir, exist_ok=True)
+        with db.engine.connect() as connection:
+            rows = student_progress(_stream(connection, _progress_query(params), batch_size, pause_seconds))
+            columns = STUDENT_COLUMNS
+            if kind == 'course':
+                rows, columns = course_progress(rows), COURSE_COLUMNS
+            _WRITERS[report_format](temp_path, columns, counted(rows), _report_title(kind, params))
+        os.replace(temp_path, path)
+        result = {'status': 'done', 'rows': written, 'file_path': path}
+        logger.info(
+            f"Informe {job_id} generado: {written} filas",
+            extra={'report_kind': kind, 'duration_ms': round((time.perf_counter() - start) * 1000, 2)}
+        )
+    except Exception as e:
+        logger.exception(f"Error al generar el informe {job_id}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        result = {'status': 'failed', 'error': str(e)}
+    finally:
+        stop_heartbeat.set()
+    finished = db.session.execute(
+        update(ReportJob)
+        .where(ReportJob.id == job_id, ReportJob.status == 'running')
+        .values(finished_at=datetime.datetime.utcnow(), **result)
+    )
+    db.session.commit()
+    if finished.rowcount != 1:
+        logger.warning(f"El informe {job_id} se dio por interrumpido antes de terminar")
+    return db.session.get(ReportJob, job_id)
+
+
+def _heartbeat(engine, job_id, stop):
+    # Transacciones cortas cada pocos segundos; la conexión vuelve al pool entre latidos
+    while not stop.wait(REPORT_HEARTBEAT_INTERVAL_SECONDS):
+        try:
+            with engine.begin() as connection:
+                connection.execute(
+                    update(ReportJob).where(ReportJob.id == job_id).values(heartbeat_at=datetime.datetime.utcnow())
+                )
+        except Exception as e:
+            logger.error(f"No se pudo anotar el latido del informe {job_id}: {e}")
+
+
+class ReportWorkerPool:
+    """Ejecuta los trabajos de informe en hilos propios, con límites por proceso."""
+
+    def __init__(self, app, max_workers=1, max_pending=4):
+        self.app = app
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='report')
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def submit(self, kind, report_format, params):
+        """Crea el trabajo y lo encola. Devuelve None si ya hay ``max_pending`` trabajos."""
+        if not self._slots.acquire(blocking=False):
+            return None
+        try:
+            job = ReportJob(kind=kind, format=report_format, params=json.dumps(params, ensure_ascii=False))
+            db.session.add(job)
+            db.session.commit()
+            self._executor.submit(self._run, job.id)
+        except Exception:
+            self._slots.release()
+            raise
+        return job
+
+    def resume_pending(self):
+        """Encola los trabajos pendientes que dejó un proceso que terminó.
+
+        Si otro proceso ya los tiene en su cola no pasa nada: solo uno consigue
+        marcarlos como 'running'. Devuelve cuántos encoló.
+        """
+        job_ids = db.session.execute(
+            select(ReportJob.id).where(ReportJob.status == 'pending').order_by(ReportJob.id)
+        ).scalars().all()
+        db.session.close()
+        resumed = 0
+        for job_id in job_ids:
+            if not self._slots.acquire(blocking=False):
+                break
+            self._executor.submit(self._run, job_id)
+            resumed += 1
+        return resumed
+
+    def _run(self, job_id):
+        try:
+            with self.app.app_context():
+                run_report_job(
+                    job_id,
+                    self.app.config['REPORTS_DIR'],
+                    pause_seconds=self.app.config.get('REPORT_BATCH_PAUSE', REPORT_BATCH_PAUSE_SECONDS),
+                )
+        except Exception:
+            logger.exception(f"Error en el worker de informes con el trabajo {job_id}")
+        finally:
+            self._slots.release()
+
+
+def fail_stale_jobs(timeout=REPORT_HEARTBEAT_TIMEOUT):
+    """Marca como fallidos los trabajos en curso cuyo worker dejó de dar señales."""
+    last_seen = func.coalesce(ReportJob.heartbeat_at, ReportJob.started_at)
+    result = db.session.execute(
+        update(ReportJob)
+        .where(ReportJob.status == 'running', last_seen < datetime.datetime.utcnow() - timeout)
+        .values(status='failed', error='Interrumpido', finished_at=datetime.datetime.utcnow())
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def start_report_workers(app, pool):
+    """Da por perdidos los informes sin latido y reanuda los pendientes.
+
+    Se llama al arrancar cada worker que atiende peticiones (ver gunicorn.conf.py),
+    no al importar la aplicación, para que los comandos de flask no tomen trabajos.
+    """
+    with app.app_context():
+        try:
+            stale = fail_stale_jobs()
+            if stale:
+                logger.warning(f"Trabajos de informe interrumpidos: {stale}")
+            resumed = pool.resume_pending()
+            if resumed:
+                logger.info(f"Trabajos de informe pendientes reanudados: {resumed}")
+        except Exception as e:
+            logger.error(f"No se pudieron revisar los trabajos de informe: {e}")
+
+
+def init_reports(app):
+    """Devuelve el pool de workers de informes del proceso.
+
+    La tabla ``report_jobs`` la crea ``init_migrations``.
+    """
+    return ReportWorkerPool(
+        app,
+        max_workers=app.config.get('REPORT_WORKERS', 1),
+        max_pending=app.config.get('REPORT_MAX_PENDING', 4),
+    )
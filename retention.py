@@ -0,0 +1,169 @@
+"""Retención, compactación y archivo del historial de ejercicios.
+
+Las filas antiguas de ``exercise_history`` se mueven a ``exercise_history_archive``
+con el texto comprimido, o se eliminan, según las políticas configuradas. La
+compactación trabaja por lotes pequeños, cada uno en su propia transacción corta,
+así que no bloquea la tabla y puede interrumpirse y volver a lanzarse en cualquier
+momento: cada lote confirmado ya no vuelve a seleccionarse.
+"""
+import datetime
+import json
+import logging
+import time
+import zlib
+from types import SimpleNamespace
+
+from sqlalchemy import delete, insert, update
+from models import db, ExerciseHistory, ExerciseHistoryArchive
+from search import remove_from_index
+
+logger = logging.getLogger(__name__)
+
+# Cada política indica la acción a la que se aplica (None = cualquiera), la edad
+# mínima en días y el modo: 'archive' comprime y mueve la fila, 'delete' la elimina.
+DEFAULT_RETENTION_POLICIES = [
+    {'action': 'initial_message', 'older_than_days': 1, 'mode': 'delete'},
+    {'action': None, 'older_than_days': 90, 'mode': 'archive'},
+]
+COMPACTION_BATCH_SIZE = 500
+# Mensaje que chat.js envía al cargar la página; antes de la columna action esas
+# filas se guardaban con action NULL y este texto como exercise_text
+LEGACY_PAGE_LOAD_MESSAGE = 'Hola'
+COMPACTION_PAUSE_SECONDS = 0.1
+
+
+def compress_payload(exercise_text, solution_text):
+    data = json.dumps({'exercise_text': exercise_text, 'solution_text': solution_text})
+    return zlib.compress(data.encode('utf-8'), 9)
+
+
+def decompress_payload(payload):
+    return json.loads(zlib.decompress(payload).decode('utf-8'))
+
+
+def _policy_filter(policy, now):
+    cutoff = now - datetime.timedelta(days=policy['older_than_days'])
+    conditions = [ExerciseHistory.timestamp < cutoff]
+    if policy.get('action'):
+        conditions.append(ExerciseHistory.action == policy['action'])
+    return conditions
+
+
+def _compact_batch(connection, policy, now, last_id, batch_size):
+    """Procesa un lote de una política. Devuelve ``(último id, filas)``; filas es 0 si no quedan."""
+    query = (
+        db.select(ExerciseHistory.__table__)
+        .where(ExerciseHistory.id > last_id, *_policy_filter(policy, now))
+        .order_by(ExerciseHistory.id)
+        .limit(batch_size)
+    )
+    if connection.dialect.name == 'postgresql':
+        # No esperar a filas que tenga bloqueadas una petición en curso
+        query = query.with_for_update(skip_locked=True)
+    rows = connection.execute(query).all()
+    if not rows:
+        return last_id, 0
+
+    if policy['mode'] == 'archive':
+        connection.execute(insert(ExerciseHistoryArchive), [{
+            'id': row.id,
+            'access_key': row.access_key,
+            'exercise_type': row.exercise_type,
+            'difficulty': row.difficulty,
+            'action': row.action,
+            'timestamp': row.timestamp,
+            'payload': compress_payload(row.exercise_text, row.solution_text),
+        } for row in rows])
+
+    for row in rows:
+        remove_from_index(connection, row.id, row.exercise_text, row.solution_text)
+    connection.execute(delete(ExerciseHistory).where(ExerciseHistory.id.in_([row.id for row in rows])))
+    return rows[-1].id, len(rows)
+
+
+def tag_legacy_page_loads(batch_size=COMPACTION_BATCH_SIZE, pause_seconds=COMPACTION_PAUSE_SECONDS):
+    """Marca como 'initial_message' las cargas de página guardadas sin acción.
+
+    Así las alcanza la política que borra esos mensajes. Recorre la tabla una vez
+    por lotes de ids; un "Hola" escrito por el alumno se marca también, lo que solo
+    adelanta el borrado de un saludo. Devuelve cuántas filas marcó.
+    """
+    tagged = 0
+    last_id = 0
+    while True:
+        with db.engine.begin() as connection:
+            ids = connection.execute(
+                db.select(ExerciseHistory.id)
+                .where(
+                    ExerciseHistory.id > last_id,
+                    ExerciseHistory.action.is_(None),
+                    ExerciseHistory.exercise_text == LEGACY_PAGE_LOAD_MESSAGE,
+                )
+                .order_by(ExerciseHistory.id)
+                .limit(batch_size)
+            ).scalars().all()
+            if not ids:
+                break
+            connection.execute(
+                update(ExerciseHistory).where(ExerciseHistory.id.in_(ids)).values(action='initial_message')
+            )
+        last_id = ids[-1]
+        tagged += len(ids)
+        time.sleep(pause_seconds)
+    if tagged:
+        logger.info(f"Cargas de página antiguas marcadas: {tagged}")
+    return tagged
+
+
+def compact_history(policies=None, batch_size=COMPACTION_BATCH_SIZE, pause_seconds=COMPACTION_PAUSE_SECONDS, max_batches=None):
+    """Aplica las políticas de retención. Devuelve cuántas filas procesó cada política.
+
+    Antes marca las cargas de página antiguas (ver ``tag_legacy_page_loads``).
+    """
+    policies = policies or DEFAULT_RETENTION_POLICIES
+    tag_legacy_page_loads(batch_size, pause_seconds)
+    now = datetime.datetime.utcnow()
+    processed = {}
+    batches = 0
+    for policy in policies:
+        key = f"{policy.get('action') or '*'}:{policy['mode']}"
+        processed[key] = 0
+        last_id = 0
+        while max_batches is None or batches < max_batches:
+            with db.engine.begin() as connection:
+                last_id, count = _compact_batch(connection, policy, now, last_id, batch_size)
+            if not count:
+                break
+            batches += 1
+            processed[key] += count
+            logger.info(f"Compactación {key}: {processed[key]} filas, último id {last_id}")
+            time.sleep(pause_seconds)
+    return processed
+
+
+def load_history(access_key):
+    """Devuelve el historial completo de una clave, combinando filas vivas y archivadas.
+
+    Las filas archivadas se descomprimen y se devuelven con los mismos atributos
+    que ``ExerciseHistory``, ordenadas por fecha junto con las vivas.
+    """
+    archived = db.session.execute(
+        db.select(ExerciseHistoryArchive).where(ExerciseHistoryArchive.access_key == access_key)
+    ).scalars().all()
+    entries = []
+    for row in archived:
+        texts = decompress_payload(row.payload)
+        entries.append(SimpleNamespace(
+            id=row.id,
+            access_key=row.access_key,
+            exercise_text=texts['exercise_text'],
+            solution_text=texts['solution_text'],
+            exercise_type=row.exercise_type,
+            difficulty=row.difficulty,
+            action=row.action,
+            timestamp=row.timestamp,
+            archived=True,
+        ))
+    entries.extend(ExerciseHistory.query.filter_by(access_key=access_key).all())
+    entries.sort(key=lambda entry: (entry.timestamp or datetime.datetime.min, entry.id))
+    return entries
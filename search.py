@@ -0,0 +1,216 @@
+"""Búsqueda de texto completo sobre el historial de ejercicios.
+
+El índice se guarda en la tabla ``exercise_history_search``: una tabla virtual FTS5
+en SQLite y una tabla con columna ``tsvector`` e índice GIN en PostgreSQL. El texto
+se normaliza (minúsculas, sin tildes) antes de indexarlo y de consultarlo, de modo
+que "función" y "funcion" encuentran lo mismo.
+"""
+import logging
+import re
+import unicodedata
+
+from sqlalchemy import event, text
+from models import db, ExerciseHistory
+
+logger = logging.getLogger(__name__)
+
+SEARCH_TABLE = 'exercise_history_search'
+MAX_PER_PAGE = 100
+REINDEX_BATCH_SIZE = 500
+
+# Sufijos habituales del español, del más largo al más corto. Solo se usan en SQLite;
+# PostgreSQL aplica su propio stemmer con la configuración 'spanish'.
+_SPANISH_SUFFIXES = (
+    'amientos', 'imientos', 'aciones', 'uciones', 'amiento', 'imiento',
+    'adoras', 'adores', 'ancias', 'idades', 'mente', 'acion', 'ucion',
+    'ancia', 'ables', 'ibles', 'istas', 'adora', 'ador', 'ante', 'anza',
+    'able', 'ible', 'ista', 'idad', 'ivas', 'ivos', 'osos', 'osas',
+    'ando', 'iendo', 'iva', 'ivo', 'oso', 'osa', 'ar', 'er', 'ir',
+    'es', 'as', 'os', 'a', 'o', 'e', 's',
+)
+_MIN_STEM_LENGTH = 3
+_WORD_RE = re.compile(r'\w+')
+
+# Se activa cuando el índice existe; mientras tanto las inserciones no se indexan
+_index_ready = False
+
+
+def fold_accents(value):
+    """Pasa el texto a minúsculas y elimina tildes y diéresis."""
+    decomposed = unicodedata.normalize('NFKD', value or '')
+    return ''.join(ch for ch in decomposed if not unicodedata.combining(ch)).lower()
+
+
+def _stem(token):
+    for suffix in _SPANISH_SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= _MIN_STEM_LENGTH:
+            return token[:-len(suffix)]
+    return token
+
+
+def analyze(value):
+    """Devuelve los términos normalizados y reducidos a su raíz de un texto."""
+    return [_stem(token) for token in _WORD_RE.findall(fold_accents(value))]
+
+
+def _is_postgres(bind):
+    return bind.dialect.name == 'postgresql'
+
+
+def create_search_index():
+    """Crea el índice de búsqueda si no existe. Es seguro llamarla varias veces."""
+    global _index_ready
+    with db.engine.begin() as connection:
+        if _is_postgres(connection):
+            connection.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+                " history_id INTEGER PRIMARY KEY REFERENCES exercise_history (id) ON DELETE CASCADE,"
+                " document tsvector NOT NULL)"
+            ))
+            connection.execute(text(
+                f"CREATE INDEX IF NOT EXISTS ix_{SEARCH_TABLE}_document "
+                f"ON {SEARCH_TABLE} USING GIN (document)"
+            ))
+        else:
+            # Tabla sin contenido: solo guarda el índice invertido, el texto vive en exercise_history
+            connection.execute(text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+                "exercise_text, solution_text, content='', tokenize='unicode61 remove_diacritics 2')"
+            ))
+    _index_ready = True
+
+
+def init_search(app):
+    """Prepara el índice al arrancar la aplicación sin impedir el arranque si falla."""
+    with app.app_context():
+        try:
+            create_search_index()
+        except Exception as e:
+            logger.error(f"No se pudo crear el índice de búsqueda: {e}")
+
+
+def index_history(connection, history_id, exercise_text, solution_text):
+    """Añade (o reemplaza) una fila del historial en el índice."""
+    if _is_postgres(connection):
+        connection.execute(text(
+            f"INSERT INTO {SEARCH_TABLE} (history_id, document) VALUES (:id, "
+            "setweight(to_tsvector('spanish', :exercise), 'A') || "
+            "setweight(to_tsvector('spanish', :solution), 'B')) "
+            "ON CONFLICT (history_id) DO UPDATE SET document = EXCLUDED.document"
+        ), {'id': history_id, 'exercise': fold_accents(exercise_text), 'solution': fold_accents(solution_text)})
+    else:
+        connection.execute(text(
+            f"INSERT OR REPLACE INTO {SEARCH_TABLE} (rowid, exercise_text, solution_text) "
+            "VALUES (:id, :exercise, :solution)"
+        ), {'id': history_id, 'exercise': ' '.join(analyze(exercise_text)), 'solution': ' '.join(analyze(solution_text))})
+
+
+def remove_from_index(connection, history_id, exercise_text, solution_text):
+    """Elimina una fila del índice. En PostgreSQL lo hace el ON DELETE CASCADE."""
+    if not _index_ready or _is_postgres(connection):
+        return
+    indexed = connection.execute(
+        text(f"SELECT rowid FROM {SEARCH_TABLE} WHERE rowid = :id"), {'id': history_id}
+    ).first()
+    if not indexed:
+        return
+    # FTS5 sin contenido exige los mismos términos que se indexaron
+    connection.execute(text(
+        f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, exercise_text, solution_text) "
+        "VALUES ('delete', :id, :exercise, :solution)"
+    ), {'id': history_id, 'exercise': ' '.join(analyze(exercise_text)), 'solution': ' '.join(analyze(solution_text))})
+
+
+def index_new_history(connection, history_id, exercise_text, solution_text):
+    """Indexa una fila recién insertada, si el índice ya existe."""
+    if _index_ready:
+        index_history(connection, history_id, exercise_text, solution_text)
+
+
+@event.listens_for(ExerciseHistory, 'after_insert')
+def _index_new_history(mapper, connection, target):
+    # Se ejecuta dentro de la misma transacción que el INSERT del historial
+    index_new_history(connection, target.id, target.exercise_text, target.solution_text)
+
+
+def rebuild_search_index(batch_size=REINDEX_BATCH_SIZE):
+    """Indexa todo el historial existente por lotes. Devuelve el número de filas indexadas."""
+    create_search_index()
+    indexed = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            db.select(ExerciseHistory.id, ExerciseHistory.exercise_text, ExerciseHistory.solution_text)
+            .where(ExerciseHistory.id > last_id)
+            .order_by(ExerciseHistory.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        with db.engine.begin() as connection:
+            for history_id, exercise_text, solution_text in rows:
+                index_history(connection, history_id, exercise_text, solution_text)
+        indexed += len(rows)
+        last_id = rows[-1].id
+        logger.info(f"Índice de búsqueda: {indexed} filas indexadas")
+    return indexed
+
+
+def search_history(query, topic=None, student=None, since=None, until=None, page=1, per_page=20):
+    """Busca en el historial y devuelve una página de resultados ordenados por relevancia.
+
+    Devuelve ``(resultados, hay_mas)``; no se calcula el total para no recorrer
+    todas las coincidencias en tablas grandes.
+    """
+    per_page = max(1, min(per_page, MAX_PER_PAGE))
+    page = max(1, page)
+    params = {'limit': per_page + 1, 'offset': (page - 1) * per_page}
+
+    if _is_postgres(db.engine):
+        params['query'] = fold_accents(query)
+        match_sql = f"{SEARCH_TABLE}.document @@ plainto_tsquery('spanish', :query)"
+        rank_sql = f"ts_rank({SEARCH_TABLE}.document, plainto_tsquery('spanish', :query)) DESC"
+        join_sql = f"h.id = {SEARCH_TABLE}.history_id"
+    else:
+        terms = analyze(query)
+        if not terms:
+            return [], False
+        # Cada término entre comillas para que FTS5 no interprete operadores del usuario
+        params['query'] = ' '.join(f'"{term}"' for term in terms)
+        match_sql = f"{SEARCH_TABLE} MATCH :query"
+        rank_sql = f"{SEARCH_TABLE}.rank"
+        join_sql = f"h.id = {SEARCH_TABLE}.rowid"
+
+    filters = [match_sql]
+    if topic:
+        filters.append("p.topic = :topic")
+        params['topic'] = topic
+    if student:
+        filters.append("p.student_email = :student")
+        params['student'] = student
+    if since:
+        filters.append("h.timestamp >= :since")
+        params['since'] = since
+    if until:
+        filters.append("h.timestamp < :until")
+        params['until'] = until
+
+    rows = db.session.execute(text(
+        "SELECT h.id, h.access_key, h.exercise_text, h.timestamp, p.topic, p.student_email "
+        f"FROM {SEARCH_TABLE} "
+        f"JOIN exercise_history h ON {join_sql} "
+        "JOIN prompts p ON p.access_key = h.access_key "
+        f"WHERE {' AND '.join(filters)} "
+        f"ORDER BY {rank_sql} "
+        "LIMIT :limit OFFSET :offset"
+    ), params).all()
+
+    results = [{
+        'id': row.id,
+        'access_key': row.access_key,
+        'exercise_text': row.exercise_text[:200],
+        'timestamp': row.timestamp.isoformat() if hasattr(row.timestamp, 'isoformat') else row.timestamp,
+        'topic': row.topic,
+        'student_email': row.student_email,
+    } for row in rows[:per_page]]
+    return results, len(rows) > per_page
@@ -7,22 +7,40 @@ document.addEventListener('DOMContentLoaded', () => {
 
     // Función del temporizador
     if (timerElement) {
-        let remainingSeconds = parseInt(timerElement.dataset.remainingSeconds, 10);
-
-        const timerInterval = setInterval(() => {
+        // Fin de la sesión en milisegundos desde epoch; la página puede venir de la caché
+        const sessionEnd = parseInt(timerElement.dataset.sessionEnd, 10);
+        // Diferencia entre el reloj del servidor y el del equipo, que puede ir desfasado.
+        // Se toma de la cabecera Date de una petición sin caché (la página cacheada
+        // llevaría una hora antigua); Date tiene resolución de segundos, de ahí los 500 ms
+        let clockOffset = 0;
+        let timerInterval = null;
+
+        function updateTimer() {
+            const remainingSeconds = Math.floor((sessionEnd - (Date.now() + clockOffset)) / 1000);
             if (remainingSeconds <= 0) {
                 clearInterval(timerInterval);
                 timerElement.innerHTML = "Sesión Expirada";
                 return;
             }
 
-            remainingSeconds--;
-
             const minutes = Math.floor(remainingSeconds / 60);
             const seconds = remainingSeconds % 60;
 
             timerElement.innerHTML = `Tiempo restante: ${minutes.toString().padStart(2, '0')}:${seconds.toString().padStart(2, '0')}`;
-        }, 1000);
+        }
+
+        fetch('/healthz', { method: 'HEAD', cache: 'no-store' })
+            .then(response => {
+                const serverNow = Date.parse(response.headers.get('Date'));
+                if (!isNaN(serverNow)) {
+                    clockOffset = serverNow + 500 - Date.now();
+                }
+            })
+            .catch(() => {})
+            .finally(() => {
+                updateTimer();
+                timerInterval = setInterval(updateTimer, 1000);
+            });
     }
 
     window.addEventListener('load', () => {
@@ -70,7 +88,9 @@ document.addEventListener('DOMContentLoaded', () => {
             payload.action = action;
         }
 
-        // Muestra el indicador de "Escribiendo..."
+        // Muestra el indicador de "Escribiendo..." debajo del mensaje recién enviado,
+        // que puede estar aún esperando al siguiente frame
+        flushMessages();
         const typingIndicator = document.createElement('div');
         typingIndicator.classList.add('message', 'assistant-message');
         typingIndicator.id = 'typing-indicator';
@@ -90,80 +110,138 @@ document.addEventListener('DOMContentLoaded', () => {
         document.getElementById('typing-indicator').remove();
 
         const data = await response.json();
-        appendMessage('assistant', data.ai_response, action);
+        appendMessage('assistant', data.ai_response, action, data.message !== undefined ? data : null);
     }
 
-    function appendMessage(sender, message, action = null) {
-        console.log("appendMessage called with sender:", sender, "message:", message, "action:", action); // Debugging
-        const messageElement = document.createElement('div');
-        messageElement.classList.add('message', `${sender}-message`);
+    // Etiquetas que el tutor puede usar en sus respuestas, convertidas en una sola pasada
+    const markupRegex = /<(\/?)(black|green|suggestion)>|\[video: (https?:\/\/[^\s\]]+)\]/g;
+    const markupClasses = { black: 'black-text', green: 'green-text', suggestion: 'suggestion-text' };
 
-        // --- LÓGICA PARA VÍDEOS ---
-        const videoRegex = /\\[video: (https?:\\/\\/[^\\s\\]]+)\\]/g;
-        let processedMessage = message.replace(videoRegex, (match, url) => {
-            return `<a href="${url}" target="_blank" class="video-button">▶️ Ver Vídeo Explicativo</a>`;
+    function renderMarkup(text) {
+        return (text || '').replace(markupRegex, (match, closing, tag, videoUrl) => {
+            if (videoUrl) {
+                return `<a href="${videoUrl}" target="_blank" class="video-button">▶️ Ver Vídeo Explicativo</a>`;
+            }
+            return closing ? '</span>' : `<span class="${markupClasses[tag]}">`;
         });
-        // --- FIN DE LA LÓGICA PARA VÍDEOS ---
-
-        // Procesar etiquetas de color (manteniendo la funcionalidad si el prompt las genera)
-        processedMessage = processedMessage.replace(/<black>/g, '<span class="black-text">');
-        processedMessage = processedMessage.replace(/<\/black>/g, '</span>');
-        processedMessage = processedMessage.replace(/<green>/g, '<span class="green-text">');
-        processedMessage = processedMessage.replace(/<\/green>/g, '</span>');
+    }
 
-        // Procesar etiqueta de sugerencia
-        processedMessage = processedMessage.replace(/<suggestion>/g, '<span class="suggestion-text">');
-        processedMessage = processedMessage.replace(/<\/suggestion>/g, '</span>');
+    // "fields" son los campos que el servidor ya separó: message, exercise, solution
+    function appendMessage(sender, message, action = null, fields = null) {
+        const messageElement = document.createElement('div');
+        messageElement.classList.add('message', `${sender}-message`);
 
-        // Si la acción es "get_solution", simplemente mostramos el mensaje como solución
-        if (action === "get_solution") {
-            messageElement.innerHTML = `<strong>Solución:</strong> ${processedMessage}`;
+        if (!fields) {
+            messageElement.innerHTML = renderMarkup(message);
+        } else if (action === "get_solution") {
+            const solutionText = fields.solution || fields.message;
+            messageElement.innerHTML = `<strong>Solución:</strong> ${renderMarkup(solutionText)}`;
         } else {
-            // Procesar ejercicio y solución usando "Ejercicio:" y "Solución:".
-            const exerciseSolutionSplit = processedMessage.split('Solución:');
-            let exerciseText = '';
-            let solutionText = '';
-
-            if (exerciseSolutionSplit.length > 1) {
-                const fullExercisePart = exerciseSolutionSplit[0];
-                const exerciseStart = fullExercisePart.indexOf('Ejercicio:');
-                if (exerciseStart !== -1) {
-                    exerciseText = fullExercisePart.substring(exerciseStart + 'Ejercicio:'.length).trim();
-                } else {
-                    exerciseText = fullExercisePart.trim();
-                }
-                
-                solutionText = exerciseSolutionSplit.slice(1).join('Solución:').trim();
+            if (fields.message) {
+                const textDiv = document.createElement('div');
+                textDiv.innerHTML = renderMarkup(fields.message);
+                messageElement.appendChild(textDiv);
+            }
 
+            if (fields.exercise) {
                 const exerciseDiv = document.createElement('div');
-                exerciseDiv.innerHTML = `<strong>Ejercicio:</strong> ${exerciseText}`;
+                exerciseDiv.innerHTML = `<strong>Ejercicio:</strong> ${renderMarkup(fields.exercise)}`;
                 messageElement.appendChild(exerciseDiv);
 
-                const solutionDiv = document.createElement('div');
-                solutionDiv.innerHTML = `<strong>Solución:</strong> ${solutionText}`;
-                solutionDiv.style.display = 'none';
-                solutionDiv.classList.add('solution-content');
-                messageElement.appendChild(solutionDiv);
-
                 const showSolutionButton = document.createElement('button');
                 showSolutionButton.innerText = 'Mostrar Solución';
                 showSolutionButton.classList.add('show-solution-button');
-                showSolutionButton.addEventListener('click', () => {
-                    sendChatMessage(exerciseText, "get_solution");
-                    showSolutionButton.style.display = 'none';
-                });
-                messageElement.appendChild(showSolutionButton);
 
-            } else {
-                messageElement.innerHTML = processedMessage;
+                if (fields.solution) {
+                    // La solución ya llegó con la respuesta: se muestra sin otra llamada
+                    const solutionDiv = document.createElement('div');
+                    solutionDiv.innerHTML = `<strong>Solución:</strong> ${renderMarkup(fields.solution)}`;
+                    solutionDiv.style.display = 'none';
+                    solutionDiv.classList.add('solution-content');
+                    messageElement.appendChild(solutionDiv);
+                    showSolutionButton.addEventListener('click', () => {
+                        solutionDiv.style.display = '';
+                        showSolutionButton.style.display = 'none';
+                    });
+                } else {
+                    showSolutionButton.addEventListener('click', () => {
+                        sendChatMessage(fields.exercise, "get_solution");
+                        showSolutionButton.style.display = 'none';
+                    });
+                }
+                messageElement.appendChild(showSolutionButton);
             }
         }
         
-        chatContainer.appendChild(messageElement);
+        queueMessage(messageElement);
+    }
+
+    // --- Renderizado incremental ---
+    // Los mensajes nuevos se insertan juntos en el siguiente frame y MathJax solo
+    // procesa esos nodos. Por encima de MAX_RENDERED_MESSAGES los más antiguos se
+    // retiran del DOM y se pueden recuperar con el botón "Ver mensajes anteriores".
+    const MAX_RENDERED_MESSAGES = 60;
+    const RESTORE_BATCH_SIZE = 20;
+    const pendingMessages = [];
+    const hiddenMessages = [];
+    let flushScheduled = false;
+    let typesetQueue = Promise.resolve();
+
+    const showOlderButton = document.createElement('button');
+    showOlderButton.innerText = 'Ver mensajes anteriores';
+    showOlderButton.classList.add('show-older-button');
+    showOlderButton.style.display = 'none';
+    showOlderButton.addEventListener('click', restoreOlderMessages);
+    chatContainer.prepend(showOlderButton);
+
+    function queueMessage(messageElement) {
+        pendingMessages.push(messageElement);
+        if (!flushScheduled) {
+            flushScheduled = true;
+            requestAnimationFrame(flushMessages);
+        }
+    }
+
+    function flushMessages() {
+        flushScheduled = false;
+        if (!pendingMessages.length) return;
+        const nodes = pendingMessages.splice(0);
+        const fragment = document.createDocumentFragment();
+        nodes.forEach(node => fragment.appendChild(node));
+        chatContainer.appendChild(fragment);
+        trimRenderedMessages();
         chatContainer.scrollTop = chatContainer.scrollHeight;
-        
-        if (typeof MathJax !== 'undefined') {
-            MathJax.typeset();
+        typesetNodes(nodes);
+    }
+
+    function typesetNodes(nodes) {
+        // MathJax se carga de forma asíncrona y sus llamadas deben encadenarse
+        if (typeof MathJax === 'undefined' || !MathJax.typesetPromise) return;
+        typesetQueue = typesetQueue
+            .then(() => MathJax.typesetPromise(nodes))
+            .catch(err => console.error('Error de MathJax:', err));
+    }
+
+    function renderedMessages() {
+        return chatContainer.querySelectorAll(':scope > .message:not(#typing-indicator)');
+    }
+
+    function trimRenderedMessages() {
+        const rendered = renderedMessages();
+        const excess = rendered.length - MAX_RENDERED_MESSAGES;
+        for (let i = 0; i < excess; i++) {
+            hiddenMessages.push(rendered[i]);
+            rendered[i].remove();
         }
+        showOlderButton.style.display = hiddenMessages.length ? '' : 'none';
+    }
+
+    function restoreOlderMessages() {
+        // Los nodos ya están tipografiados por MathJax, no hay que volver a procesarlos
+        const restored = hiddenMessages.splice(-RESTORE_BATCH_SIZE);
+        const fragment = document.createDocumentFragment();
+        restored.forEach(node => fragment.appendChild(node));
+        showOlderButton.after(fragment);
+        showOlderButton.style.display = hiddenMessages.length ? '' : 'none';
     }
 });
@@ -0,0 +1,137 @@
+"""Respuestas estructuradas del tutor.
+
+El modelo responde con un JSON que sigue ``TUTOR_RESPONSE_SCHEMA``; se analiza una
+sola vez en el servidor y los campos se guardan en el historial y se envían ya
+separados al navegador. ``parse_legacy_response`` interpreta las respuestas en
+texto libre ("Ejercicio: ... Solución: ...") guardadas antes de este formato.
+"""
+import json
+import logging
+import re
+
+from models import db, ExerciseHistory
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH_SIZE = 500
+
+TUTOR_RESPONSE_SCHEMA = {
+    'name': 'tutor_response',
+    'strict': True,
+    'schema': {
+        'type': 'object',
+        'properties': {
+            'message': {'type': 'string'},
+            'exercise': {'type': ['string', 'null']},
+            'solution': {'type': ['string', 'null']},
+            'exercise_type': {'type': ['string', 'null']},
+            'difficulty': {'type': ['string', 'null']},
+        },
+        'required': ['message', 'exercise', 'solution', 'exercise_type', 'difficulty'],
+        'additionalProperties': False,
+    },
+}
+
+RESPONSE_FORMAT_INSTRUCTIONS = (
+    "\n\nResponde siempre con un objeto JSON con estos campos: "
+    "'message' (tu mensaje para el alumno), "
+    "'exercise' (el enunciado si propones o resuelves un ejercicio, o null), "
+    "'solution' (la solución paso a paso si la das, o null), "
+    "'exercise_type' (el tipo o tema del ejercicio, o null) y "
+    "'difficulty' ('fácil', 'media', 'difícil' o null)."
+)
+
+INVALID_RESPONSE_MESSAGE = "Lo siento, no he podido completar la respuesta. ¿Puedes repetir la pregunta?"
+
+_EXERCISE_TYPE_RE = re.compile(r'\((.*?)\):')
+
+
+def _empty_fields(message):
+    return {'message': message, 'exercise': None, 'solution': None, 'exercise_type': None, 'difficulty': None}
+
+
+def parse_tutor_response(raw):
+    """Convierte la respuesta del modelo en un diccionario con los campos del esquema.
+
+    Si la respuesta es texto normal (por ejemplo, el mensaje de error de
+    ``get_ai_response``) se devuelve entera como ``message``. Si parece JSON pero
+    no se puede leer (una respuesta cortada), se devuelve ``INVALID_RESPONSE_MESSAGE``
+    para no mostrar ni guardar el JSON en bruto.
+    """
+    try:
+        data = json.loads(raw)
+    except (TypeError, ValueError):
+        if isinstance(raw, str) and raw.lstrip().startswith(('{', '[')):
+            logger.warning(f"Respuesta JSON del modelo no válida ({len(raw)} caracteres)")
+            return _empty_fields(INVALID_RESPONSE_MESSAGE)
+        return _empty_fields(raw)
+    if not isinstance(data, dict):
+        return _empty_fields(INVALID_RESPONSE_MESSAGE)
+    fields = _empty_fields(data.get('message') or '')
+    for key in ('exercise', 'solution', 'exercise_type', 'difficulty'):
+        if data.get(key):
+            fields[key] = str(data[key]).strip()
+    return fields
+
+
+def format_plain_text(fields):
+    """Texto legible de una respuesta, para el historial y los clientes antiguos."""
+    parts = [fields['message']] if fields['message'] else []
+    if fields['exercise']:
+        parts.append(f"Ejercicio: {fields['exercise']}")
+    if fields['solution']:
+        parts.append(f"Solución: {fields['solution']}")
+    return '\n\n'.join(parts)
+
+
+def parse_legacy_response(text):
+    """Extrae ejercicio, solución y tipo de una respuesta en texto libre."""
+    fields = _empty_fields(text)
+    if 'Solución:' not in text:
+        return fields
+    exercise_part, solution = text.split('Solución:', 1)
+    exercise_start = exercise_part.find('Ejercicio:')
+    if exercise_start != -1:
+        fields['message'] = exercise_part[:exercise_start].strip()
+        exercise_part = exercise_part[exercise_start + len('Ejercicio:'):]
+    else:
+        fields['message'] = ''
+    fields['exercise'] = exercise_part.strip() or None
+    fields['solution'] = solution.strip() or None
+    if fields['exercise']:
+        type_match = _EXERCISE_TYPE_RE.search(fields['exercise'])
+        if type_match:
+            fields['exercise_type'] = type_match.group(1).strip()[:120]
+    return fields
+
+
+def backfill_structured_fields(start_id=0, batch_size=BACKFILL_BATCH_SIZE):
+    """Rellena exercise_type en el historial antiguo analizando el texto guardado.
+
+    Recorre las filas sin tipo por lotes de id creciente; cada lote se confirma por
+    separado, así que puede retomarse pasando el último id registrado en el log.
+    Devuelve el número de filas actualizadas.
+    """
+    updated = 0
+    last_id = start_id
+    while True:
+        rows = db.session.execute(
+            db.select(ExerciseHistory.id, ExerciseHistory.solution_text)
+            .where(ExerciseHistory.id > last_id, ExerciseHistory.exercise_type.is_(None))
+            .order_by(ExerciseHistory.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        changes = []
+        for history_id, solution_text in rows:
+            fields = parse_legacy_response(solution_text)
+            if fields['exercise_type']:
+                changes.append({'id': history_id, 'exercise_type': fields['exercise_type']})
+        if changes:
+            db.session.execute(db.update(ExerciseHistory), changes)
+        db.session.commit()
+        updated += len(changes)
+        last_id = rows[-1].id
+        logger.info(f"Backfill de campos estructurados: {updated} filas actualizadas, último id {last_id}")
+    return updated
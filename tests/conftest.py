@@ -0,0 +1,31 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# La aplicación se configura al importarse: base de datos temporal y claves de prueba
+_db_dir = tempfile.mkdtemp(prefix='tutor-tests-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_db_dir, 'test.db')
+os.environ.setdefault('OPENAI_API_KEY', 'test')
+os.environ.setdefault('FLASK_SECRET_KEY', 'test')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TEST_ACCESS_KEY = 'testkey000000001'
+
+
+@pytest.fixture(scope='session')
+def tutor_app():
+    import app as tutor_app
+    import database
+    from replay import StubLLMClient
+    tutor_app.client = StubLLMClient(0)
+    with tutor_app.app.app_context():
+        prompt_id = database.add_prompt('alumno@example.com', 'Bucles', 'Eres un tutor de pruebas.', TEST_ACCESS_KEY)
+        database.add_predefined_exercise(prompt_id, 'Suma los números del 1 al 10', 1)
+    return tutor_app
+
+
+@pytest.fixture
+def client(tutor_app):
+    return tutor_app.app.test_client()
@@ -0,0 +1,37 @@
+import pytest
+
+from conftest import TEST_ACCESS_KEY
+
+
+@pytest.fixture
+def throttled_guard(tutor_app):
+    guard = tutor_app.access_guard
+    previous = guard.throttle, guard.max_failures
+    guard.throttle, guard.max_failures = True, 3
+    guard._failures.clear()
+    yield guard
+    guard.throttle, guard.max_failures = previous
+    guard._failures.clear()
+
+
+def test_valid_key_is_never_throttled(client, throttled_guard):
+    for _ in range(5):
+        client.get('/check_access/invalidkey000000')
+    assert client.get('/check_access/invalidkey000000').status_code == 429
+    assert client.get(f'/check_access/{TEST_ACCESS_KEY}').status_code == 200
+
+
+def test_api_chat_throttle_returns_json(client, throttled_guard):
+    for _ in range(5):
+        client.post('/api/chat', json={'access_key': 'invalidkey000000', 'user_message': 'Hola'})
+    response = client.post('/api/chat', json={'access_key': 'invalidkey000000', 'user_message': 'Hola'})
+    assert response.status_code == 429
+    assert response.get_json()['ai_response']
+
+
+def test_throttle_disabled_without_trusted_proxy(client, tutor_app):
+    # La configuración de pruebas no define TRUSTED_PROXIES ni ACCESS_KEY_THROTTLE
+    assert tutor_app.app.config['ACCESS_KEY_THROTTLE'] is False
+    for _ in range(40):
+        client.get('/check_access/invalidkey000000')
+    assert client.get('/check_access/invalidkey000000').status_code == 404
@@ -0,0 +1,55 @@
+import pytest
+
+from conftest import TEST_ACCESS_KEY
+from query_budget import assert_max_queries, count_queries
+
+# Los límites incluyen la consulta de max(prompts.id) con la que el filtro de
+# claves se actualiza como mucho una vez por segundo (ver access_keys.py)
+
+
+def test_chat_page_queries(client):
+    # Prompt con su plantilla, versión de los ejercicios y lista de ejercicios
+    with assert_max_queries(4):
+        response = client.get(f'/chat/{TEST_ACCESS_KEY}')
+    assert response.status_code == 200
+
+
+def test_chat_page_revalidation_skips_exercise_list(client):
+    etag = client.get(f'/chat/{TEST_ACCESS_KEY}').headers['ETag']
+    with assert_max_queries(3):
+        response = client.get(f'/chat/{TEST_ACCESS_KEY}', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+
+def test_api_chat_queries(client):
+    # Prompt, registro de la llamada al modelo, historial y su entrada en el índice
+    with assert_max_queries(5):
+        response = client.post('/api/chat', json={'access_key': TEST_ACCESS_KEY, 'user_message': 'Hola'})
+    assert response.status_code == 200
+
+
+def test_assert_max_queries_reports_statements(tutor_app):
+    with pytest.raises(AssertionError, match='prompts'):
+        with tutor_app.app.app_context(), assert_max_queries(0):
+            tutor_app.database.get_prompt_record(TEST_ACCESS_KEY)
+
+
+def test_count_queries_is_scoped_to_block(tutor_app):
+    with tutor_app.app.app_context():
+        with count_queries() as counter:
+            tutor_app.database.get_prompt_record(TEST_ACCESS_KEY)
+        tutor_app.database.get_prompt_record(TEST_ACCESS_KEY)
+    assert counter.count == 1
+
+
+def test_failed_query_does_not_skew_timings(tutor_app):
+    from sqlalchemy import text
+    with tutor_app.app.app_context():
+        connection = tutor_app.database.db.session.connection()
+        with pytest.raises(Exception):
+            connection.execute(text('SELECT * FROM tabla_inexistente'))
+        assert 'query_start' not in connection.info
+        tutor_app.database.db.session.rollback()
+        with count_queries() as counter:
+            tutor_app.database.get_prompt_record(TEST_ACCESS_KEY)
+    assert counter.count == 1
@@ -0,0 +1,63 @@
+"""Captura de tráfico para pruebas de rendimiento.
+
+Con ``TRAFFIC_CAPTURE_FILE`` definido, cada petición a las rutas capturadas deja
+una línea JSON con metadatos anónimos: ruta, acción, tamaños de petición y
+respuesta, estado, duración e instante de llegada. No se guardan claves de acceso
+ni textos. La escritura pasa por una cola y un hilo aparte, como el resto de logs.
+``replay.py`` reproduce estas trazas.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import time
+
+from flask import g, request
+
+CAPTURED_ROUTES = ('/api/chat', '/generate_exercise', '/submit_solution')
+
+
+def init_traffic_capture(app):
+    """Registra los hooks de captura si ``TRAFFIC_CAPTURE_FILE`` está configurado."""
+    path = app.config.get('TRAFFIC_CAPTURE_FILE')
+    if not path:
+        return None
+
+    capture_logger = logging.getLogger('traffic_capture')
+    capture_logger.propagate = False
+    capture_logger.setLevel(logging.INFO)
+    output = logging.FileHandler(path, encoding='utf-8')
+    output.setFormatter(logging.Formatter('%(message)s'))
+    capture_queue = queue.SimpleQueue()
+    capture_logger.addHandler(logging.handlers.QueueHandler(capture_queue))
+    listener = logging.handlers.QueueListener(capture_queue, output)
+    listener.start()
+    atexit.register(listener.stop)
+
+    @app.before_request
+    def _start_capture():
+        if request.path in CAPTURED_ROUTES:
+            # Instante de llegada para la traza; la duración se mide con perf_counter
+            g.capture_arrival = time.time()
+            g.capture_start = time.perf_counter()
+
+    @app.after_request
+    def _finish_capture(response):
+        start = g.pop('capture_start', None)
+        if start is None:
+            return response
+        data = request.get_json(silent=True) or {}
+        capture_logger.info(json.dumps({
+            'ts': g.pop('capture_arrival'),
+            'route': request.path,
+            'action': data.get('action'),
+            'request_bytes': request.content_length or 0,
+            'message_chars': len(data.get('user_message') or data.get('solution_text') or ''),
+            'response_bytes': response.calculate_content_length() or 0,
+            'status': response.status_code,
+            'duration_ms': round((time.perf_counter() - start) * 1000, 2),
+        }))
+        return response
+
+    return listener
@@ -0,0 +1,88 @@
+"""Calentamiento del proceso antes de recibir tráfico.
+
+``warm_up`` abre las conexiones del pool de la base de datos, configura los
+mappers de SQLAlchemy, compila todas las plantillas de Jinja y abre la conexión
+TLS con la API de OpenAI, para que la primera petición no pague esos costes.
+``/readyz`` responde 200 solo cuando ha terminado.
+
+En producción lo llama ``post_worker_init`` en gunicorn.conf.py, antes de que el
+worker acepte peticiones.
+"""
+import datetime
+import logging
+import threading
+import time
+
+from sqlalchemy import text
+from sqlalchemy.orm import configure_mappers
+from models import db
+
+logger = logging.getLogger(__name__)
+
+warmup_state = {
+    'ready': False,
+    'started_at': None,
+    'duration_ms': None,
+    'errors': [],
+}
+_warmup_lock = threading.Lock()
+
+
+def _open_db_connections():
+    # Abrir a la vez tantas conexiones como admite el pool para que queden creadas
+    size = db.engine.pool.size() if hasattr(db.engine.pool, 'size') else 1
+    connections = []
+    try:
+        for _ in range(size):
+            connection = db.engine.connect()
+            connection.execute(text('SELECT 1'))
+            connections.append(connection)
+    finally:
+        for connection in connections:
+            connection.close()
+
+
+def _compile_templates(app):
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+
+def _prime_llm_client(llm_client):
+    # Petición ligera que deja abierta la conexión keep-alive con la API
+    llm_client.with_options(max_retries=0, timeout=10).models.list()
+
+
+def warm_up(app, llm_client=None):
+    """Ejecuta todos los pasos de calentamiento. Un paso que falla no impide los demás."""
+    with _warmup_lock:
+        if warmup_state['ready']:
+            return warmup_state
+        start = time.perf_counter()
+        warmup_state['started_at'] = datetime.datetime.utcnow().isoformat()
+        warmup_state['errors'] = []
+        steps = [
+            ('mappers', configure_mappers),
+            ('database', _open_db_connections),
+            ('templates', lambda: _compile_templates(app)),
+        ]
+        if llm_client is not None:
+            steps.append(('llm', lambda: _prime_llm_client(llm_client)))
+        with app.app_context():
+            for name, step in steps:
+                try:
+                    step()
+                except Exception as e:
+                    logger.error(f"Error en el calentamiento ({name}): {e}")
+                    warmup_state['errors'].append(name)
+        warmup_state['duration_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        # Un fallo al contactar con OpenAI no debe dejar el worker fuera de servicio
+        warmup_state['ready'] = 'database' not in warmup_state['errors']
+        logger.info(f"Calentamiento terminado en {warmup_state['duration_ms']} ms")
+        return warmup_state
+
+
+def start_warm_up(app, llm_client=None):
+    """Lanza el calentamiento en un hilo aparte."""
+    thread = threading.Thread(target=warm_up, args=(app, llm_client), daemon=True)
+    thread.start()
+    return thread